@@ -0,0 +1,192 @@
+"""Reproducible benchmarks for the extraction and rendering hot paths.
+
+    python benchmarks/bench_pipeline.py                      # full run, table on stdout
+    python benchmarks/bench_pipeline.py --quick -o new.json  # smaller cases, save results
+    python benchmarks/bench_pipeline.py --compare old.json   # diff against a previous run
+
+Scenes and custom packs are generated from a fixed seed, so runs on the
+same machine are comparable. Each benchmark reports latency percentiles,
+throughput and the tracemalloc peak of one call. "legacy_find_terms" is
+the original one-regex-per-term matcher, kept as the reference point.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kling_core as core  # noqa: E402
+
+SEED = 1234
+SCENE_WORDS = {"paragraph": 80, "page": 500, "scene": 2_000, "screenplay": 30_000}
+CUSTOM_PACK_SIZES = {"custom-1k": 1_000, "custom-10k": 10_000}
+FILLER = ("the a and with of in through under while as his her their slowly quietly across beyond "
+          "stands walks turns looks holds raises whispers watches moves waits").split()
+NAMES = ["Alaric", "Mira", "Vance", "Lola", "Kaito", "Zara", "Orin", "Sefa"]
+
+
+def legacy_find_terms(text, vocab):
+    found = []
+    t = text.lower()
+    for term in sorted(vocab, key=lambda x: -len(x)):
+        if re.search(rf'(?<!\w){re.escape(term)}(?!\w)', t):
+            found.append(term)
+    return found
+
+
+def make_custom_pack(size, rng):
+    syllables = "ka ri to mo zen lu vex dra sil or tha quen bel mur ash iv".split()
+    pack = {cat: [] for cat in core.VOCAB}
+    cats = list(pack)
+    for i in range(size):
+        words = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3))]
+        pack[cats[i % len(cats)]].append(" ".join(words))
+    return pack
+
+
+def make_scene(words, vocab, rng):
+    terms = sorted(set().union(*vocab.terms.values()))
+    out, sentence = [], 0
+    while len(out) < words:
+        r = rng.random()
+        if r < 0.15:
+            out.append(rng.choice(terms))
+        elif r < 0.2:
+            out.append(rng.choice(NAMES))
+        else:
+            out.append(rng.choice(FILLER))
+        sentence += 1
+        if sentence > rng.randint(8, 18):
+            out[-1] += "."
+            sentence = 0
+            if rng.random() < 0.2:
+                out[-1] += "\n\n"
+    return " ".join(out)
+
+
+def measure(fn, min_time, min_runs, max_runs):
+    fn()  # warm-up
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() - start < min_time):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+
+    def pct(p):
+        return times[min(len(times) - 1, int(p / 100 * len(times)))] * 1e3
+
+    total = sum(times)
+    return {
+        "runs": len(times), "p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99),
+        "mean_ms": total / len(times) * 1e3, "ops_per_s": len(times) / total if total else 0.0,
+        "peak_kb": peak / 1024,
+    }
+
+
+def vocab_cases(quick, rng):
+    packs = [core.DEFAULT_PACK] if quick else list(core.STORY_PACKS)
+    for name in packs:
+        yield name, core.get_vocabulary(name)
+    for label, size in CUSTOM_PACK_SIZES.items():
+        if quick and size > 1_000:
+            continue
+        yield label, core.get_vocabulary(core.DEFAULT_PACK, make_custom_pack(size, rng))
+
+
+def run(args):
+    # The synthetic custom packs are trusted input and deliberately larger than the
+    # per-request limit, which get_vocabulary() would otherwise enforce
+    core.MAX_PACK_TERMS = max(core.MAX_PACK_TERMS, *CUSTOM_PACK_SIZES.values())
+    rng = random.Random(SEED)
+    sizes = {k: v for k, v in SCENE_WORDS.items() if not (args.quick and v > 2_000)}
+    timing = dict(min_time=args.min_time, min_runs=3, max_runs=args.max_runs)
+    results = []
+
+    def record(bench, vocab_name, size, text, fn):
+        if args.filter and not re.search(args.filter, bench):
+            return
+        row = {"bench": bench, "vocab": vocab_name, "size": size, "chars": len(text)}
+        row.update(measure(fn, **timing))
+        row["mb_per_s"] = len(text) / 1e6 * row["ops_per_s"]
+        results.append(row)
+        print(f"{bench:<22} {vocab_name:<32} {size:<11} p50 {row['p50_ms']:9.3f} ms  p99 {row['p99_ms']:9.3f} ms  "
+              f"{row['ops_per_s']:9.1f}/s  peak {row['peak_kb']:9.1f} KB", file=sys.stderr)
+
+    for vocab_name, vocab in vocab_cases(args.quick, rng):
+        custom = None if vocab_name in core.STORY_PACKS else make_custom_pack(CUSTOM_PACK_SIZES[vocab_name], random.Random(SEED))
+        pack = vocab_name if custom is None else core.DEFAULT_PACK
+        all_terms = set().union(*vocab.terms.values())
+        for size, words in sizes.items():
+            text = make_scene(words, vocab, rng)
+            record("vocabulary_build", vocab_name, size, text,
+                   lambda: core.Vocabulary([core.STORY_PACKS[pack]] + ([custom] if custom else []), ""))
+            record("matcher_find_all", vocab_name, size, text, lambda: vocab.matcher.find_all(text))
+            if args.legacy and len(all_terms) * len(text) <= args.legacy_budget:
+                record("legacy_find_terms", vocab_name, size, text,
+                       lambda: [legacy_find_terms(text, terms) for terms in vocab.terms.values()])
+            record("proper_names", vocab_name, size, text, lambda: core.proper_names(text, vocab.matcher))
+            extraction = core.extract(text, vocab)
+            record("build_prompt", vocab_name, size, text, lambda: core.build_prompt(
+                core.compose_sections(extraction), mode="concise"))
+            record("pipeline_cold", vocab_name, size, text,
+                   lambda: core.perfect_prompt(text, pack=pack, custom_pack=custom, cache=None))
+            record("pipeline_warm", vocab_name, size, text,
+                   lambda: core.perfect_prompt(text, pack=pack, custom_pack=custom))
+    return results
+
+
+def compare(new, old_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["bench"], r["vocab"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"{'bench':<22} {'vocab':<32} {'size':<11} {'old p50':>10} {'new p50':>10} {'speedup':>8}")
+    for r in new:
+        prev = old.get((r["bench"], r["vocab"], r["size"]))
+        if prev:
+            ratio = prev["p50_ms"] / r["p50_ms"] if r["p50_ms"] else float("inf")
+            print(f"{r['bench']:<22} {r['vocab']:<32} {r['size']:<11} {prev['p50_ms']:10.3f} {r['p50_ms']:10.3f} {ratio:7.2f}x")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("-o", "--output", help="write machine-readable results (JSON) here")
+    p.add_argument("--compare", metavar="JSON", help="print speedups against a previous results file")
+    p.add_argument("--quick", action="store_true", help="base vocabulary, 1k custom pack and scenes up to 2k words")
+    p.add_argument("--filter", help="regex on benchmark names")
+    p.add_argument("--no-legacy", dest="legacy", action="store_false", help="skip the legacy regex matcher")
+    p.add_argument("--legacy-budget", type=float, default=2e8,
+                   help="skip legacy cases where terms x chars exceeds this (default 2e8)")
+    p.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per benchmark (default 0.5)")
+    p.add_argument("--max-runs", type=int, default=1000)
+    args = p.parse_args(argv)
+
+    results = run(args)
+    doc = {
+        "meta": {
+            "python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": SEED, "quick": args.quick,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
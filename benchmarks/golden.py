@@ -0,0 +1,353 @@
+"""Golden-output regression corpus: frozen prompts for every story pack x style preset.
+
+    python benchmarks/golden.py                              # check the built-in engines
+    python benchmarks/golden.py --engine mymod:extract       # check a candidate engine too
+    python benchmarks/golden.py --min-speedup 5 -o run.json  # gate on speed, save results
+    python benchmarks/golden.py --freeze                     # re-freeze after a deliberate change
+
+The corpus (benchmarks/golden/corpus.json) holds scenes for each story
+pack, seeded filler from bench_pipeline.make_scene plus the hand-written
+HAND_SCENES, and the prompts the pipeline rendered for them: every pack
+with every style preset (options rotate through brevity, labels,
+max_items, character, negative prompt, JSON output and token budgets),
+plus every scene of every pack in each brevity mode. Scenes are stored,
+not regenerated, so the corpus stays fixed when the generators change.
+
+An engine is anything with extract()'s signature, `fn(text, vocab)`
+returning {"names": [...], "terms": TermMatches}, named as
+"module:function". Built in are "trie" (extract()), "stream" (the
+chunked TermStream/NameStream of streaming and oversized inputs) and
+"incremental" (IncrementalExtraction after a replayed editing session),
+all checked by default, and "legacy", the original app: one regex per
+exact term and every capitalized word as a name. Each engine extracts
+every scene, the prompts are rendered from its extractions and compared
+with the frozen ones, and its extraction time is reported as a speedup
+over the baseline (--baseline, "legacy" by default). A mismatch in a
+checked engine, or a speedup under --min-speedup, exits non-zero; the
+baseline's mismatches are only reported unless it is checked too, since
+legacy's prompts differ by design. When a change is meant to alter
+prompts, review the diffs and re-freeze.
+"""
+import argparse
+import difflib
+import importlib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kling_core as core  # noqa: E402
+from bench_pipeline import make_scene  # noqa: E402
+
+SEED = 2024
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "corpus.json")
+SCENE_WORDS = (40, 150, 600)
+MODES = ("concise", "standard", "verbose")
+
+# Hand-written scenes, two per pack: the kind of prose the app is given, unlike
+# the seeded filler scenes, which only exercise the matcher on dense vocabulary.
+HAND_SCENES = {
+    "General (Default)": [
+        "Mira walks through the old village at dawn, her scarf pulled tight against the wind. A tall guard waits "
+        "by the gate with a lantern, watching the fog lift off the forest. Wide shot, soft light, calm mood.",
+        "Vance kneels in the workshop and turns a brass gear over in his hands. Sparks drift from the machine "
+        "behind him. Nobody speaks. Slowly he reaches for the hammer on the bench. Low angle, dramatic shadows, "
+        "cinematic, highly detailed.",
+    ],
+    "The Clockwork Alchemist": [
+        "Alaric adjusts his brass goggles and leans over the workbench of the clockwork workshop. Steam hisses from "
+        "a cracked steam valve while the arc lamp flickers overhead. He lifts an ether vial to the light; it glows "
+        "verdigris and copper. Close-up, lantern glow, foreground gears, tense, steampunk, highly detailed.",
+        "Standing on the airship deck at dawn fog, the airship captain checks her brass pocketwatch. Isolde, her "
+        "apprentice, wipes her oil-stained gloves on a tattered coat and watches the pressure gauge climb. "
+        "Embers and sparks drift past. Wide shot, backlit silhouette, epic.",
+    ],
+    "Neon Sci-Fi / Cyberpunk": [
+        "Kira sprints down a rain-soaked alley, her neon jacket streaked with magenta and cyan reflections. A drone "
+        "tracks her from above. She slots a data shard into her cybernetic arm and the holo-screen on the wall "
+        "glitches. Low angle, neon glow, reflections in puddles, rain droplets, cyberpunk, tense.",
+        "JUNO\nWe're late.\n\nThe netrunner sits on the rooftop skyline at night, smog rolling over the megacity "
+        "block. Her augmented eyes pick out a corporate agent three floors down. Over-the-shoulder, hologram "
+        "spill, lens flare, noir.",
+    ],
+    "Medieval High Fantasy": [
+        "Alaric draws his longsword and faces the dragon in the castle hall. Torchlight catches his plate armor and "
+        "the crimson tabard over it. Behind him the sorceress raises her crystal staff, embers and magic particles "
+        "swirling. Low angle, epic, god rays, painterly, highly detailed.",
+        "At dawn, Elowen the ranger leads the king through the enchanted forest, her hooded cloak wet with fog. "
+        "She stops at the ancient ruins and strings her enchanted bow. Establishing shot, foreground foliage, "
+        "sunbeams, mystical, hopeful.",
+    ],
+    "Gothic Horror": [
+        "Sister Agathe climbs the stairs of the abandoned manor at midnight with a single candle. Candlelight shows "
+        "the pale skin of the vampire waiting on the landing, his fangs bared. She raises her crucifix. Dutch "
+        "angle, hard shadows, heavy vignette, ominous, macabre.",
+        "Rain falls on the graveyard at dusk. The monster hunter, in a long tailcoat and leather gloves, pries open "
+        "a coffin with a silver dagger. Fog and mist curl around the crypt. High angle, moonlight, sepia, "
+        "painterly, dramatic shadows.",
+    ],
+    "Space Opera": [
+        "Admiral Vance stands on the starship bridge, his cape stirring in the console glow. Through the viewport "
+        "a starfighter peels away trailing sparks and debris. The holomap shows the ice moon. Wide shot, rule of "
+        "thirds, heroic, cinematic, 4k.",
+        "The smuggler checks her blaster in the hangar bay while the alien envoy, tendrils twitching, watches from "
+        "the ramp. Dust storm warnings flash in azure and violet. Over-the-shoulder, volumetric beams, urgent, "
+        "hdr, highly detailed.",
+    ],
+    "Noir Detective": [
+        "Rain hammers the office with blinds. Detective Harlan Cole pours a whisky glass and stares at the "
+        "photograph on his desk. Venetian blind light cuts across his trench coat and fedora. Cigarette smoke "
+        "hangs in the air. Close-up, low key, noir, black and white, grain.",
+        "INT. JAZZ CLUB - NIGHT\n\nThe femme fatale in an evening gown slides a matchbook across the bar to the "
+        "bartender.\n\nLOLA\n(softly)\nHe never made it to the motel room.\n\nA mobster watches from the booth, "
+        "revolver under the table. Over-the-shoulder, neon sign, tense, melancholic.",
+    ],
+    "Modern Romance / Slice of Life": [
+        "Hana waits on a park bench in the golden hour, a coffee cup in both hands and her denim jacket over a "
+        "sundress. A musician plays guitar nearby. She checks her smartphone and smiles. Mid-shot, soft daylight, "
+        "foreground bokeh, warm tones, tender.",
+        "At the train station in the evening, the photographer lowers her camera when he steps off with a "
+        "bouquet. Drizzle beads on his school uniform. Neither of them moves. Close-up, neon reflections, "
+        "bittersweet, nostalgic, illustration.",
+    ],
+    "Post-Apocalyptic Survival": [
+        "Rook picks through the abandoned mall at noon, gas mask fogged, crossbow slung across patched leather. A "
+        "broken radio crackles in his pack. Outside, a dust storm swallows the ruined city. Wide shot, harsh "
+        "sunlight, lonely silhouette, grim, desaturated, grain.",
+        "The wanderer and a gaunt survivor share canned food beside a rusty car on the collapsed highway at "
+        "sunset. Smoke haze hangs over the desert wasteland. Low angle, vast negative space, desperate, "
+        "cinematic, highly detailed.",
+    ],
+    "Mythic Africa": [
+        "Amara, the warrior queen, walks the savannah at blazing noon with a spear in her hand and kente cloth "
+        "across her shoulders. The griot follows, beating a drum. Establishing shot, ceremonial procession, "
+        "earthy palette, majestic, painterly.",
+        "By the sacred river on a moonlit night the rain shaman lifts a calabash over the ancestral shrine. "
+        "Firelight plays over ceremonial masks and beadwork. Low angle, moonlit ritual glow, spiritual, solemn, "
+        "highly detailed.",
+    ],
+    "Arabian Nights Fantasy": [
+        "Zahir, a desert thief in flowing robes, slips through the bazaar with a stolen magic lamp under his arm. "
+        "A caravan guard draws his scimitar. Saffron and turquoise awnings snap in the hot wind. Wide shot, "
+        "golden glow, adventurous, painterly.",
+        "Under a starlit night the sultan stands in the palace hall beside an open treasure chest. The genie "
+        "rises from the lamp in a swirl of gold. Low angle, torchlight, arched frames, enchanting, mysterious, "
+        "cinematic.",
+    ],
+    "Far East Mythology": [
+        "Kenji, a samurai in a straw hat and hakama, crosses the bamboo forest at misty dawn. His katana rests on "
+        "his shoulder. Ahead, a torii gate stands half hidden in fog. Three-quarter view, lantern glow, "
+        "serene, ink, crisp lines.",
+        "The shrine maiden hangs an ofuda scroll on the mountain shrine as snow falls on a moonlit night. A yokai "
+        "with fox ears watches from the torii pathway. Low angle, moonlight, indigo and vermillion, foreboding, "
+        "painterly.",
+    ],
+    "Prehistoric Adventure": [
+        "Ugo, the tribal elder, raises a fire torch at the mouth of the cave at twilight. Behind him the "
+        "hunter-gatherer band grips stone spears, war paint streaked across their faces. Wide shot, firelight, "
+        "smoke-filled air, primal, painterly.",
+        "At dawn a mammoth herd fords the river crossing while ash fall drifts from the volcanic plain. The "
+        "shaman beats a drum on the bank, wrapped in furs and animal hides. Low angle, volcanic glow, ochre and "
+        "charcoal, awe-inspiring, highly detailed.",
+    ],
+    "Western Frontier": [
+        "Sheriff Eli Boone pushes through the saloon doors at blazing noon, spurs ringing and a revolver on his "
+        "hip. The gambler at the corner table lays down his deck of cards. Cowboy shot, doorway framing, harsh "
+        "sun, tense, sepia, grain.",
+        "The outlaw rides out of the dusty town at sunset silhouette, bandana over his face and a lasso on the "
+        "saddle. Dust wind rolls across the desert canyon. Wide shot, long shadow, lawless, cinematic, highly "
+        "detailed.",
+    ],
+}
+
+
+def legacy_proper_names(text):
+    """The original proper_names(): every capitalized word, line by line, in first-seen order."""
+    names = []
+    for line in text.split("\n"):
+        for tok in re.findall(r"\b[A-Z][a-zA-Z'-]+\b", line):
+            if tok not in names:
+                names.append(tok)
+    return names
+
+
+def legacy_extract(text, vocab):
+    """extract() as the original app did it: one regex per exact term, no spelling variants."""
+    matcher, t = vocab.matcher, text.lower()
+    stats = {}
+    for tid, term in enumerate(matcher.terms):
+        for m in re.finditer(rf"(?<!\w){re.escape(term)}(?!\w)", t):
+            s = stats.setdefault(tid, [0, m.start()])
+            s[0] += 1
+    return {"names": legacy_proper_names(text), "terms": matcher.route(stats, len(t))}
+
+
+def stream_extract(text, vocab, chunk=61):
+    """extract() through TermStream/NameStream, fed in small odd-sized chunks so
+    terms and names straddle chunk boundaries."""
+    from kling_stream import NameStream, TermStream
+
+    terms, names = TermStream(vocab.matcher), NameStream(vocab.matcher)
+    for i in range(0, len(text), chunk):
+        terms.feed(text[i:i + chunk])
+        names.feed(text[i:i + chunk])
+    return {"names": names.close(), "terms": vocab.matcher.route(terms.close(), terms.length)}
+
+
+def incremental_extract(text, vocab, piece=200):
+    """extract() as IncrementalExtraction ends up after a replayed editing session:
+    the text typed piece by piece with its middle piece left out, then a stray
+    insertion in the gap, then the middle piece in its place."""
+    from kling_incremental import IncrementalExtraction
+
+    live = IncrementalExtraction(vocab)
+    middle = len(text) // 2
+    head, gap, tail = text[:middle], text[middle:middle + piece], text[middle + piece:]
+    typed = head + tail
+    for end in range(piece, len(typed) + piece, piece):
+        live.update(typed[:end])
+    live.update(head + "stray words " + tail)
+    return live.update(head + gap + tail)
+
+
+ENGINES = {"trie": core.extract, "legacy": legacy_extract, "stream": stream_extract,
+           "incremental": incremental_extract}
+
+
+def resolve_engine(spec):
+    if spec in ENGINES:
+        return ENGINES[spec]
+    module, _, attr = spec.partition(":")
+    if not attr:
+        raise SystemExit(f"unknown engine {spec!r}: use {', '.join(ENGINES)} or module:function")
+    return getattr(importlib.import_module(module), attr)
+
+
+def make_scenes(pack, rng):
+    vocab = core.get_vocabulary(pack)
+    scenes = [make_scene(words, vocab, rng) for words in SCENE_WORDS]
+    # the longest scene is laid out as a screenplay: heading, upper-case cue, dialogue
+    cue = rng.choice(["MIRA", "VANCE", "LOLA"])
+    scenes[-1] = f"INT. WAREHOUSE - NIGHT\n\n{scenes[-1]}\n\n{cue}\n(quietly)\nWe leave at dawn.\n"
+    return scenes + HAND_SCENES[pack]
+
+
+def corpus_cases(scenes):
+    """(pack, scene index, options) for every case the corpus freezes."""
+    for pack, texts in scenes.items():
+        for i, style in enumerate(core.STYLE_PRESETS):
+            yield pack, i % len(texts), {
+                "style": style, "brevity": MODES[i % 3], "labels": i % 2 == 0, "max_items": (10, 5, 0, 3)[i % 4],
+                "char_name": "Mira" if i % 4 == 1 else "", "char_sheet": "tall, scar over left eye" if i % 5 == 2 else "",
+                "negative": "blurry, extra limbs" if i % 5 == 3 else "", "fmt": "json" if i % 7 == 4 else "text",
+                "budget": 40 if i % 6 == 5 else 0,
+            }
+        for n in range(len(texts)):
+            for mode in MODES:
+                for labels in (True, False):
+                    yield pack, n, {"style": core.DEFAULT_STYLE, "brevity": mode, "labels": labels}
+
+
+def render(extraction, options):
+    return core.render_prompt(extraction, **options)
+
+
+def freeze(path):
+    rng = random.Random(SEED)
+    scenes = {pack: make_scenes(pack, rng) for pack in core.STORY_PACKS}
+    cases = []
+    for pack, n, options in corpus_cases(scenes):
+        extraction = core.extract(scenes[pack][n], core.get_vocabulary(pack))
+        cases.append({"pack": pack, "scene": n, "options": options, "prompt": render(extraction, options)})
+    doc = {"meta": {"seed": SEED, "match_variants": core.MATCH_VARIANTS,
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+           "scenes": scenes, "cases": cases}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+    print(f"froze {len(cases)} prompts over {sum(map(len, scenes.values()))} scenes to {path}", file=sys.stderr)
+
+
+def time_engine(fn, scenes, min_time):
+    """Extractions of every scene by `fn`, and the best total time of repeated passes."""
+    vocabs = {pack: core.get_vocabulary(pack) for pack in scenes}
+    extractions = {pack: [fn(text, vocabs[pack]) for text in texts] for pack, texts in scenes.items()}
+    best, spent = float("inf"), 0.0
+    while spent < min_time or best == float("inf"):
+        t0 = time.perf_counter()
+        for pack, texts in scenes.items():
+            for text in texts:
+                fn(text, vocabs[pack])
+        took = time.perf_counter() - t0
+        best, spent = min(best, took), spent + took
+    return extractions, best
+
+
+def check(doc, engines, baseline, min_time, show):
+    scenes, chars = doc["scenes"], sum(len(t) for texts in doc["scenes"].values() for t in texts)
+    results = {}
+    for name in dict.fromkeys([baseline, *engines]):
+        extractions, best = time_engine(resolve_engine(name), scenes, min_time)
+        mismatches = []
+        for case in doc["cases"]:
+            got = render(extractions[case["pack"]][case["scene"]], case["options"])
+            if got != case["prompt"]:
+                mismatches.append((case, got))
+        results[name] = {"seconds": best, "mb_per_s": chars / 1e6 / best if best else 0.0,
+                         "cases": len(doc["cases"]), "mismatches": len(mismatches)}
+        for case, got in mismatches[:show]:
+            label = f"{case['pack']} / scene {case['scene']} / {case['options']}"
+            print(f"--- {name}: {label}", file=sys.stderr)
+            sys.stderr.writelines(difflib.unified_diff(case["prompt"].splitlines(True), got.splitlines(True),
+                                                       "frozen", name))
+            print(file=sys.stderr)
+    base = results[baseline]["seconds"]
+    for r in results.values():
+        r["speedup"] = base / r["seconds"] if r["seconds"] else float("inf")
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--corpus", default=CORPUS, help="corpus file (default benchmarks/golden/corpus.json)")
+    p.add_argument("--freeze", action="store_true", help="regenerate the corpus from the current pipeline")
+    p.add_argument("--engine", action="append", metavar="NAME",
+                   help="engine to check: trie, stream, incremental, legacy or module:function "
+                        "(repeatable; default trie, stream and incremental)")
+    p.add_argument("--baseline", default="legacy", help="engine speedups are measured against (default legacy)")
+    p.add_argument("--min-speedup", type=float, default=0.0, help="fail if a checked engine is slower than this")
+    p.add_argument("--min-time", type=float, default=1.0, help="seconds to spend timing each engine (default 1)")
+    p.add_argument("--show", type=int, default=5, help="diffs to print per engine (default 5)")
+    p.add_argument("-o", "--output", help="write machine-readable results (JSON) here")
+    args = p.parse_args(argv)
+
+    if args.freeze:
+        freeze(args.corpus)
+        return 0
+    with open(args.corpus, encoding="utf-8") as f:
+        doc = json.load(f)
+    if doc["meta"]["match_variants"] != core.MATCH_VARIANTS:
+        raise SystemExit(f"corpus was frozen with KLING_MATCH_VARIANTS={doc['meta']['match_variants']}, "
+                         f"this process uses {core.MATCH_VARIANTS}")
+    engines = args.engine or ["trie", "stream", "incremental"]
+    results = check(doc, engines, args.baseline, args.min_time, args.show)
+    failed = False
+    print(f"{'engine':<32} {'cases':>6} {'mismatch':>9} {'total ms':>10} {'MB/s':>8} {'speedup':>8}")
+    for name, r in results.items():
+        gate = name in engines and r["speedup"] < args.min_speedup
+        failed |= bool(r["mismatches"]) and name in engines or gate
+        print(f"{name:<32} {r['cases']:6d} {r['mismatches']:9d} {r['seconds'] * 1e3:10.2f} {r['mb_per_s']:8.2f} "
+              f"{r['speedup']:7.2f}x" + ("  below --min-speedup" if gate else ""))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": dict(doc["meta"], baseline=args.baseline), "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Batch mode: perfect many scenes from a JSONL/CSV file over a process pool.
+
+Each row holds the scene text plus optional per-row options (pack, style,
+brevity, labels, max_items, char_name, char_sheet, negative, custom_pack)
+that override the batch defaults. Results come back in input order.
+Every worker keeps its own ENGINE_CACHE, so each distinct pack/custom-pack
+vocabulary is built at most once per worker.
+"""
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from kling_core import BREVITY, OUTPUT_FORMATS, PACKS, STYLE_PRESETS, VOCAB, perfect_prompt
+from kling_packs import MAX_PACK_TERMS, MAX_TERM_CHARS, load_pack, validate_pack
+
+TEXT_FIELDS = ("text", "scene", "prompt")
+OPTION_FIELDS = ("pack", "style", "brevity", "labels", "max_items", "char_name", "char_sheet", "negative", "custom_pack",
+                 "fmt", "budget")
+STRING_FIELDS = ("char_name", "char_sheet", "negative")
+# option -> the values it accepts, as the CLI's choices
+CHOICES = {"pack": PACKS, "style": STYLE_PRESETS, "brevity": BREVITY, "fmt": OUTPUT_FORMATS}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path or "")[1].lower()
+    return {".csv": "csv", ".txt": "txt"}.get(ext, "jsonl")
+
+
+class BadRow(dict):
+    """An input line that could not be parsed; perfect_row() returns it as its error result."""
+
+
+def read_rows(f, fmt="jsonl"):
+    if fmt == "csv":
+        for row in csv.DictReader(f):
+            yield row
+        return
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield BadRow(error=f"line {lineno}: invalid JSON ({e})")
+            continue
+        yield row if isinstance(row, dict) else {"text": str(row)}
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() not in ("", "0", "false", "no", "off")
+    return bool(value)
+
+
+def _as_int(key, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{key} must be an integer, not {type(value).__name__}")
+    try:
+        return int(value)
+    except (ValueError, OverflowError):
+        raise ValueError(f"{key} must be an integer, not {value!r}") from None
+
+
+def row_options(row, defaults=None):
+    """(text, perfect_prompt() options) for one row; ValueError for an invalid option."""
+    options = dict(defaults or {})
+    for key in OPTION_FIELDS:
+        value = row.get(key)
+        if value is None or value == "":
+            continue
+        if key in CHOICES:
+            if not isinstance(value, str) or value not in CHOICES[key]:
+                raise ValueError(f"unknown {key}: {value!r}")
+        elif key in STRING_FIELDS:
+            if not isinstance(value, str):
+                raise ValueError(f"{key} must be a string, not {type(value).__name__}")
+        elif key == "labels":
+            value = _as_bool(value)
+        elif key in ("max_items", "budget"):
+            value = _as_int(key, value)
+        elif key == "custom_pack" and isinstance(value, str):
+            value = load_pack(value, VOCAB, name="custom_pack", known=VOCAB)
+        elif key == "custom_pack":
+            value = validate_pack(value, VOCAB, source="custom_pack", known=VOCAB,
+                                  max_terms=MAX_PACK_TERMS, max_term_chars=MAX_TERM_CHARS)
+        options[key] = value
+    text = next((row[k] for k in TEXT_FIELDS if row.get(k)), "")
+    if not isinstance(text, str):
+        raise ValueError(f"text must be a string, not {type(text).__name__}")
+    return text, options
+
+
+def perfect_row(row, defaults=None):
+    if isinstance(row, BadRow):
+        return dict(row)
+    result = {"id": row.get("id")} if "id" in row else {}
+    try:
+        text, options = row_options(row, defaults)
+        result["prompt"] = perfect_prompt(text, **options)
+    except (ValueError, TypeError) as e:
+        result["error"] = str(e)
+    return result
+
+
+def _perfect_chunk(rows, defaults):
+    return [perfect_row(row, defaults) for row in rows]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def perfect_batch(rows, defaults=None, workers=None, chunksize=32):
+    """Yield one result dict per row, in input order.
+
+    Rows are consumed lazily and at most two chunks per worker are in
+    flight, so memory stays bounded for arbitrarily long inputs.
+    workers=1 runs in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for row in rows:
+            yield perfect_row(row, defaults)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in _chunks(rows, chunksize):
+            pending.append(pool.submit(_perfect_chunk, chunk, defaults))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def write_results(results, f, fmt="jsonl"):
+    if fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=["id", "prompt", "error"], extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+    elif fmt == "txt":
+        for i, result in enumerate(results):
+            if i:
+                f.write("\n")
+            f.write((result.get("prompt") or f"# error: {result.get('error')}") + "\n")
+    else:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
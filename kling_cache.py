@@ -0,0 +1,124 @@
+"""Result caches shared by every session in the process.
+
+Two layers, each an in-memory LRU optionally backed by sqlite so results
+survive restarts:
+- extractions: names + matched term IDs, keyed by a digest of text + vocabulary
+- renders: final prompt text, keyed by the extraction key + render options
+
+A render-option change (labels, brevity, max_items, ...) misses only the
+render layer, so the scan over the text is skipped.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+
+class LRUStore:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStore:
+    """Persistent key -> JSON value table, trimmed to roughly `max_rows`."""
+
+    TRIM_EVERY = 1000
+
+    def __init__(self, path, table, max_rows=100_000):
+        import sqlite3
+
+        self.table = table
+        self.max_rows = max_rows
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, raw))
+            self._writes += 1
+            if self._writes % self.TRIM_EVERY == 0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE rowid <= (SELECT MAX(rowid) FROM {self.table}) - ?",
+                    (self.max_rows,),
+                )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+
+class TieredCache:
+    def __init__(self, capacity=1024, backend=None):
+        self.memory = LRUStore(capacity)
+        self.backend = backend
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+
+class ResultCache:
+    def __init__(self, capacity=1024, path=None, max_rows=100_000):
+        self.path = path
+        self.extractions = TieredCache(capacity, SqliteStore(path, "extractions", max_rows) if path else None)
+        self.renders = TieredCache(capacity, SqliteStore(path, "renders", max_rows) if path else None)
+
+    def clear(self):
+        self.extractions.clear()
+        self.renders.clear()
+
+    def stats(self):
+        return {
+            name: {"hits": layer.hits, "misses": layer.misses, "entries": len(layer.memory)}
+            for name, layer in (("extractions", self.extractions), ("renders", self.renders))
+        }
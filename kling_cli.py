@@ -0,0 +1,197 @@
+"""Command-line front end for the Kling Prompt Perfecter.
+
+    python kling_cli.py scene.txt --pack "Noir Detective" --brevity concise
+    cat scene.txt | python kling_cli.py -
+    python kling_cli.py scenes/*.txt -o prompts/
+    python kling_cli.py --batch scenes.jsonl --workers 8 -o prompts.jsonl
+    python kling_cli.py --stream screenplay.txt
+    python kling_cli.py --sequence screenplay.txt -o shots.zip
+    python kling_cli.py scene.txt --custom-pack big.json --profile
+"""
+import argparse
+import os
+import sys
+
+from kling_core import DEFAULT_PACK, DEFAULT_STYLE, OUTPUT_FORMATS, PACKS, STYLE_PRESETS, VOCAB, perfect_prompt
+from kling_packs import load_pack
+
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="kling_cli", description="Turn cinematic scene text into Kling-friendly prompts.")
+    p.add_argument("inputs", nargs="*", help="scene text files ('-' or none reads stdin)")
+    p.add_argument("-o", "--output", help="write one <name>.kling.txt per input into this directory instead of stdout "
+                                           "(with --batch: the results file, format from its extension)")
+    p.add_argument("--pack", default=DEFAULT_PACK, help="story pack name (see --list-packs)")
+    p.add_argument("--style", default=DEFAULT_STYLE, help="style preset name (see --list-styles)")
+    p.add_argument("--brevity", choices=["concise", "standard", "verbose"], default="standard")
+    p.add_argument("--no-labels", dest="labels", action="store_false", help="omit section labels")
+    p.add_argument("--max-items", type=int, default=10, help="max terms per section (0 = unlimited)")
+    p.add_argument("--char-name", default="", help="main character name")
+    p.add_argument("--char-sheet", default="", help="character sheet traits")
+    p.add_argument("--negative", default="", help="negative prompt")
+    p.add_argument("--format", dest="fmt", choices=OUTPUT_FORMATS, default="text",
+                   help="prompt output: text, or JSON sections ({label: [items]})")
+    p.add_argument("--budget", type=int, default=0, help="trim each prompt to about this many tokens (0 = no limit)")
+    p.add_argument("--custom-pack", help="JSON file with extra vocabulary to merge on top of the pack")
+    p.add_argument("--batch", metavar="FILE", help="JSONL/CSV of scenes with optional per-row options ('-' = stdin)")
+    p.add_argument("--batch-format", choices=["jsonl", "csv", "txt"], help="override the batch input/output format")
+    p.add_argument("--workers", type=int, help="batch worker processes (default: CPU count)")
+    p.add_argument("--chunksize", type=int, default=32, help="rows per worker task in batch mode")
+    p.add_argument("--stream", action="store_true", help="treat inputs as long scripts: one prompt per scene, read in chunks")
+    p.add_argument("--sequence", action="store_true",
+                   help="render the inputs as one shot list (one input is split into scenes, several are one scene "
+                        "each); -o picks .zip/.json/.csv/.txt by extension")
+    p.add_argument("--split", choices=["auto", "heading", "blank"], default="auto",
+                   help="scene splitting in --stream/--sequence mode (default: blank lines until the first INT./EXT. heading)")
+    p.add_argument("--profile", action="store_true",
+                   help="profile each prompt: write <name>.kling.pstats and <name>.kling.folded (collapsed stacks) "
+                        "next to the output and print a per-stage summary to stderr")
+    p.add_argument("--profile-time", type=float, default=1.0, help="seconds of stack sampling per input (default 1)")
+    p.add_argument("--list-packs", action="store_true", help="print story pack names and exit")
+    p.add_argument("--list-styles", action="store_true", help="print style preset names and exit")
+    return p
+
+
+def _read(path):
+    if path == "-":
+        return sys.stdin.read()
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _out_name(path):
+    stem = "stdin" if path == "-" else os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}.kling.txt"
+
+
+def _stream(path, options, split, out):
+    from kling_stream import stream_prompts
+
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for scene, prompt in stream_prompts(f, split=split, **options):
+            if scene.index > 1:
+                out.write("\n")
+            out.write(f"# Scene {scene.index}" + (f": {scene.heading}" if scene.heading else "") + "\n")
+            out.write(prompt + "\n")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _profile(path, text, options, args):
+    from kling_profile import profile_prompt
+
+    result = profile_prompt(text, duration=args.profile_time, **options)
+    stem = os.path.join(args.output or ".", _out_name(path)[:-len(".txt")])
+    with open(stem + ".pstats", "wb") as f:
+        f.write(result.pstats_bytes())
+    with open(stem + ".folded", "w", encoding="utf-8") as f:
+        f.write(result.collapsed())
+    print(f"# profile: {stem}.pstats, {stem}.folded", file=sys.stderr)
+    sys.stderr.write(result.summary())
+    return result.prompt
+
+
+def run_sequence(args, options):
+    from kling_sequence import build_sequence, sequence_from_text, shot_list_csv, shot_list_json, shot_list_txt, shot_list_zip
+
+    inputs = args.inputs or ["-"]
+    if len(inputs) == 1:
+        seq = sequence_from_text(_read(inputs[0]), split=args.split, **options)
+    else:
+        seq = build_sequence([(os.path.basename(path), _read(path)) for path in inputs], **options)
+    ext = os.path.splitext(args.output or "")[1].lower()
+    if ext == ".zip":
+        with open(args.output, "wb") as f:
+            f.write(shot_list_zip(seq, os.path.splitext(os.path.basename(args.output))[0]))
+        return 0
+    render = {".json": shot_list_json, ".csv": shot_list_csv}.get(ext, shot_list_txt)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            f.write(render(seq))
+    else:
+        sys.stdout.write(render(seq))
+    return 0
+
+
+def run_batch(args, options):
+    from contextlib import ExitStack
+    from kling_batch import detect_format, perfect_batch, read_rows, write_results
+
+    with ExitStack() as stack:
+        src = sys.stdin if args.batch == "-" else stack.enter_context(open(args.batch, encoding="utf-8", newline=""))
+        dst = sys.stdout if not args.output else stack.enter_context(open(args.output, "w", encoding="utf-8", newline=""))
+        rows = read_rows(src, detect_format(args.batch if args.batch != "-" else None, args.batch_format))
+        results = perfect_batch(rows, defaults=options, workers=args.workers, chunksize=args.chunksize)
+        write_results(results, dst, detect_format(args.output, args.batch_format))
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.list_packs or args.list_styles:
+        names = PACKS.names() if args.list_packs else STYLE_PRESETS
+        print("\n".join(names))
+        return 0
+    if args.pack not in PACKS:
+        parser.error(f"unknown story pack: {args.pack!r}")
+    try:
+        PACKS.get(args.pack)
+    except (OSError, ValueError) as e:
+        parser.error(f"failed to load story pack: {e}")
+    if args.style not in STYLE_PRESETS:
+        parser.error(f"unknown style preset: {args.style!r}")
+
+    custom_pack = None
+    if args.custom_pack:
+        try:
+            with open(args.custom_pack, "rb") as f:
+                custom_pack = load_pack(f, VOCAB, name=args.custom_pack, known=VOCAB)
+        except (OSError, ValueError) as e:
+            parser.error(f"failed to load custom pack: {e}")
+
+    options = dict(
+        pack=args.pack, style=args.style, brevity=args.brevity, labels=args.labels,
+        max_items=args.max_items, char_name=args.char_name, char_sheet=args.char_sheet,
+        negative=args.negative, custom_pack=custom_pack, fmt=args.fmt, budget=args.budget,
+    )
+    if args.profile and (args.batch or args.sequence or args.stream):
+        parser.error("--profile profiles single prompts; it cannot be combined with --batch, --sequence or --stream")
+    if args.batch:
+        return run_batch(args, options)
+    if args.sequence:
+        return run_sequence(args, options)
+
+    inputs = args.inputs or ["-"]
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    for i, path in enumerate(inputs):
+        if args.stream:
+            if args.output:
+                with open(os.path.join(args.output, _out_name(path)), "w", encoding="utf-8") as f:
+                    _stream(path, options, args.split, f)
+            else:
+                if i:
+                    print()
+                _stream(path, options, args.split, sys.stdout)
+            continue
+        if args.profile:
+            prompt = _profile(path, _read(path), options, args)
+        else:
+            prompt = perfect_prompt(_read(path), **options)
+        if args.output:
+            with open(os.path.join(args.output, _out_name(path)), "w", encoding="utf-8") as f:
+                f.write(prompt + "\n")
+        else:
+            if i:
+                print()
+            print(prompt)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1113 @@
+"""Kling Prompt Perfecter core: vocabularies, term extraction and prompt rendering.
+
+Importable without Streamlit; the app, CLI and batch tools all go through
+perfect_prompt().
+"""
+import re, json, functools, hashlib, math, os, sys, threading
+from array import array
+from collections import OrderedDict
+from types import MappingProxyType
+
+from kling_cache import ResultCache
+from kling_metrics import NULL_TRACE, Metrics
+from kling_packs import MAX_PACK_TERMS, PackRegistry
+from kling_variants import variant_index
+
+# -----------------------------
+# Utilities
+# -----------------------------
+def _kw(*items):
+    return frozenset(i.lower() for i in items)
+
+class TermMatcher:
+    """Finds the terms of many vocabularies in a single pass over the text.
+
+    All terms share one character trie. A compiled regex yields every
+    position that could start a term (a first character not preceded by a
+    word character) and each one walks the trie for at most the length of
+    the longest term, so the cost is linear in the text rather than
+    terms x text. Matches keep find_terms' semantics: whole words only,
+    overlapping terms all count, longest terms first.
+
+    Terms are interned and numbered longest-first, so sorted IDs are render
+    order. Each ID carries a bitmask of its categories: a term listed in
+    several ("silhouette", "smoke") is matched once and routed to each.
+    The trie is one flat edge table keyed by node << 21 | codepoint rather
+    than a dict per node. `featured` terms (those a story or custom pack
+    adds) are flagged per ID for relevance scoring. `variants` maps extra
+    spellings to a term (see kling_variants); they share the trie and
+    match as that term's ID.
+    """
+
+    def __init__(self, vocabs, featured=(), variants=None):
+        self.categories = tuple(vocabs)
+        if len(self.categories) > 64:
+            raise ValueError("TermMatcher supports at most 64 categories")
+        self.bits = {cat: 1 << i for i, cat in enumerate(self.categories)}
+        masks = {}
+        for cat, terms in vocabs.items():
+            bit = self.bits[cat]
+            for term in terms:
+                term = term.lower()
+                if term:
+                    masks[term] = masks.get(term, 0) | bit
+        self.terms = tuple(sys.intern(t) for t in sorted(masks, key=lambda x: (-len(x), x)))
+        self.masks = array("Q", [masks[t] for t in self.terms])
+        featured = {t.lower() for t in featured}
+        self.featured = array("B", [t in featured for t in self.terms])
+        self._index = {t: i for i, t in enumerate(self.terms)}
+        self.variants = {v: self._index[t] for v, t in (variants or {}).items() if t in self._index and v}
+        edges, term_at = {}, array("i", [-1])
+        for tid, term in [*enumerate(self.terms), *((tid, v) for v, tid in self.variants.items())]:
+            node = 0
+            for ch in term:
+                key = node << 21 | ord(ch)
+                nxt = edges.get(key)
+                if nxt is None:
+                    nxt = edges[key] = len(term_at)
+                    term_at.append(-1)
+                node = nxt
+            if term_at[node] < 0:
+                term_at[node] = tid
+        self._edges, self._term_at = edges, term_at
+        first = "".join(sorted({t[0] for t in self.terms} | {v[0] for v in self.variants}))
+        self._starts = re.compile(rf"(?<!\w)[{re.escape(first)}]") if first else None
+        self.longest = max(map(len, [*self.terms[:1], *self.variants]), default=0)
+        # Containers plus the objects they hold: the edge table's int keys and
+        # node values are as large as the table itself
+        size = sys.getsizeof
+        self.nbytes = (size(edges) + sum(map(size, edges)) + sum(map(size, edges.values()))
+                       + size(term_at) + size(self.masks) + size(self.featured)
+                       + size(self._index) + sum(map(size, self._index.values()))
+                       + size(self.terms) + sum(map(size, self.terms))
+                       + size(self.variants) + sum(map(size, self.variants)) + sum(map(size, self.variants.values())))
+
+    def locate(self, t, pos=0, stop=None):
+        """Every term in already-lowercased `t` that starts in [pos, stop), as
+        (start, id) pairs in text order.
+
+        Characters outside the range still count as boundary context, which
+        is what lets TermStream feed a long text through in chunks.
+        """
+        found = []
+        if self._starts is None:
+            return found
+        get, term_at, n = self._edges.get, self._term_at, len(t)
+        stop = n if stop is None else stop
+        for m in self._starts.finditer(t, pos):
+            start = j = m.start()
+            if j >= stop:
+                break
+            node = get(ord(t[j]))
+            while node is not None:
+                j += 1
+                tid = term_at[node]
+                if tid >= 0 and (j == n or not (t[j].isalnum() or t[j] == "_")):
+                    found.append((start, tid))
+                if j == n:
+                    break
+                node = get(node << 21 | ord(t[j]))
+        return found
+
+    def tally(self, t, pos=0, stop=None, offset=0):
+        """{id: [count, first start + offset]} for the occurrences locate() finds."""
+        stats = {}
+        for start, tid in self.locate(t, pos, stop):
+            s = stats.get(tid)
+            if s is None:
+                stats[tid] = [1, start + offset]
+            else:
+                s[0] += 1
+        return stats
+
+    def route(self, hits, length=0):
+        """TermMatches for a set of IDs, or for tally() stats over a text of `length` chars."""
+        if isinstance(hits, dict):
+            ids = sorted(hits)
+            return TermMatches(self, ids, [hits[i][0] for i in ids], [hits[i][1] for i in ids], length)
+        return TermMatches(self, hits)
+
+    def find_all(self, text):
+        t = text.lower()
+        return self.route(self.tally(t), len(t))
+
+    def __contains__(self, term):
+        return term in self._index or term in self.variants
+
+    def __len__(self):
+        return len(self.terms)
+
+class TermMatches:
+    """Matched term IDs for one text, in render (longest-first) order.
+
+    Strings are only looked up when a category is read, e.g. at render time.
+    `counts` and `first` (occurrences and first offset, parallel to `ids`)
+    feed relevance scoring; `counts` and `first` must follow sorted `ids`.
+    """
+
+    __slots__ = ("matcher", "ids", "counts", "first", "length")
+
+    def __init__(self, matcher, ids, counts=None, first=None, length=0):
+        self.matcher = matcher
+        if counts is None:
+            self.ids = array("I", sorted(ids))
+            self.counts = array("I", [1]) * len(self.ids)
+            self.first = array("I", [0]) * len(self.ids)
+        else:
+            self.ids = array("I", ids)
+            self.counts = array("I", counts)
+            self.first = array("I", first)
+        self.length = length
+
+    def ids_for(self, category):
+        bit, masks = self.matcher.bits[category], self.matcher.masks
+        return [i for i in self.ids if masks[i] & bit]
+
+    def by_category(self):
+        """{category: [ids]} for every category, in one pass over the IDs."""
+        cats = self.matcher.categories
+        lists = [[] for _ in cats]
+        masks = self.matcher.masks
+        for i in self.ids:
+            m = masks[i]
+            while m:
+                low = m & -m
+                lists[low.bit_length() - 1].append(i)
+                m ^= low
+        return dict(zip(cats, lists))
+
+    def __getitem__(self, category):
+        terms = self.matcher.terms
+        return [terms[i] for i in self.ids_for(category)]
+
+    def keys(self):
+        return self.matcher.categories
+
+    def items(self):
+        terms = self.matcher.terms
+        return [(cat, [terms[i] for i in ids]) for cat, ids in self.by_category().items()]
+
+    def __eq__(self, other):
+        if isinstance(other, TermMatches):
+            return self.matcher is other.matcher and self.ids == other.ids
+        return NotImplemented
+
+    __hash__ = None
+
+def find_terms(text, vocab):
+    return TermMatcher({None: vocab}).find_all(text)[None]
+
+NAME_STOPWORDS = frozenset("""
+a about above across after again against all also an and another any are around as at away back be because
+before behind below beneath beside besides between beyond both but by can could cut day did do does down during
+each either even every ext fade far few for from further had has have he her here hers him his how however i if
+in inside instead int into is it its just later least less like many may me meanwhile might more most much must
+my near neither never next night no none nor not now of off often on once one only onto or other our out outside
+over perhaps quickly rather she should silently since slowly so some somewhere soon still such suddenly than that
+the their them then there these they this those though through throughout thus to together too toward towards
+under until up upon us very was we well were what when where whether which while who whom whose why will with
+within without yes yet you your nothing everything something anything nobody everyone someone moments
+""".split())
+
+_NAME_TOKEN = re.compile(r"\b[A-Z][a-zA-Z'-]+\b")
+_NAME_OPENERS = " \t\"'([*-"  # skipped when looking back for the end of the previous sentence
+_SENTENCE_ENDS = ".!?\n"
+_WORD_PUNCT = ".,;:!?\"'()[]*-"
+_ORDINARY_ENDINGS = ("ing", "ly")  # gerunds and adverbs opening a sentence (not "Kelly", "Emily")
+
+class NameTally:
+    """Counts capitalized name candidates in a single pass.
+
+    Stopwords ("The", "Suddenly", ...) are ignored everywhere; words in
+    `exclude` (typically the vocabulary, e.g. "Rain droplets fall") are
+    ignored only when they start a sentence. feed() may be called
+    repeatedly with consecutive pieces of a text split on whitespace.
+
+    A capitalized word that only ever opens a sentence is dropped when there
+    is evidence it is an ordinary word: the text also uses it in lowercase,
+    or it reads as a gerund or adverb ("Standing at the edge, Alaric...",
+    "Slowly, Mira turns"). Names that open sentences ("Alaric draws his
+    sword.") are kept.
+    """
+
+    def __init__(self, exclude=()):
+        self.counts = {}
+        self.mid = set()  # tokens seen at least once mid-sentence
+        self.words = set()  # whitespace-separated words of the text, punctuation attached
+        self.exclude = exclude
+        self._initial = True
+
+    def feed(self, text):
+        counts, exclude, openers = self.counts, self.exclude, _NAME_OPENERS
+        self.words.update(text.split())
+        for m in _NAME_TOKEN.finditer(text):
+            tok = m.group()
+            if tok.endswith("'s"):
+                tok = tok[:-2]
+            tok = tok.rstrip("'-")
+            low = tok.lower()
+            if len(tok) < 2 or low in NAME_STOPWORDS:
+                continue
+            j = m.start() - 1
+            while j >= 0 and text[j] in openers:
+                j -= 1
+            initial = self._initial if j < 0 else text[j] in _SENTENCE_ENDS
+            if initial and low in exclude:
+                continue
+            if not initial:
+                self.mid.add(tok)
+            counts[tok] = counts.get(tok, 0) + 1
+        tail = text.rstrip(openers)
+        if tail:
+            self._initial = tail[-1] in _SENTENCE_ENDS
+        return self
+
+    def ranked(self):
+        lower = {w for w in (w.strip(_WORD_PUNCT) for w in self.words) if w[:1].islower()}
+        counts = {}
+        for tok, n in self.counts.items():
+            # fold screenplay cues ("LOLA") into the mixed-case spelling when both occur
+            if tok.isupper() and tok.title() in self.counts:
+                tok = tok.title()
+            elif tok not in self.mid:
+                low = tok.lower()
+                if low in lower or (len(low) > 5 and low.endswith(_ORDINARY_ENDINGS)):
+                    continue
+            counts[tok] = counts.get(tok, 0) + n
+        # sorted() is stable, so equally frequent names keep first-seen order
+        return sorted(counts, key=counts.__getitem__, reverse=True)
+
+def proper_names(text, exclude=()):
+    return NameTally(exclude).feed(text).ranked()
+
+def compress_list(items, max_items):
+    return items[:max_items] if max_items and max_items > 0 else items
+
+# Relevance of a matched term: log frequency, how early it first appears,
+# and whether the story/custom pack supplies it.
+RELEVANCE_WEIGHTS = {"frequency": 1.0, "position": 0.5, "pack": 1.0}
+
+def relevance_scores(matches, weights=RELEVANCE_WEIGHTS):
+    """{term id: score} for every term in `matches` (one scene's TermMatches)."""
+    wf, wp, wk = weights["frequency"], weights["position"], weights["pack"]
+    featured, span = matches.matcher.featured, max(matches.length, 1)
+    return {tid: wf * math.log1p(c) + wp * (1.0 - f / span) + wk * featured[tid]
+            for tid, c, f in zip(matches.ids, matches.counts, matches.first)}
+
+def top_terms(ids, max_items, scores):
+    """The `max_items` best-scoring of `ids`, kept in their original order."""
+    if not max_items or max_items <= 0 or len(ids) <= max_items:
+        return ids
+    # sorted() is stable, so equal scores keep render (longest-first) order
+    best = sorted(range(len(ids)), key=lambda n: -scores[ids[n]])[:max_items]
+    return [ids[n] for n in sorted(best)]
+
+_ARTICLES = re.compile(r"\b(a|an|the)\b ", re.I)
+CHARS_PER_TOKEN = 4  # rough estimate used by token budgets
+OUTPUT_FORMATS = ("text", "json")
+
+@functools.lru_cache(maxsize=8192)
+def _concise(item):
+    # Items repeat heavily (vocabulary terms), so each is stripped once per process
+    return _ARTICLES.sub("", item)
+
+def _verbose(item):
+    return item.replace(",", ", ")
+
+# Brevity mode -> (per-item transform, item separator). Applying the transform
+# to items rather than joined lines gives the same text; verbose keeps its
+# established ",  " separator.
+BREVITY = {
+    "standard": (None, ", "),
+    "concise": (_concise, ", "),
+    "verbose": (_verbose, ",  "),
+}
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def _fit(rows, sep, use_labels, limit):
+    """Keep a prefix of each section's items so the text fits in `limit` chars.
+
+    Items are admitted round-robin (every section's first item, then every
+    second item, ...), so trimming shortens all sections before dropping any.
+    """
+    kept, closed, used = [0] * len(rows), [False] * len(rows), 0
+    for k in range(max(len(items) for _, items in rows)):
+        for n, (label, items) in enumerate(rows):
+            if closed[n] or k >= len(items):
+                continue
+            if k:
+                cost = len(sep) + len(items[k])
+            else:
+                cost = len(items[0]) + (len(label) + 2 if use_labels else 0) + (1 if used else 0)
+            if used + cost > limit:
+                closed[n] = True
+                continue
+            used += cost
+            kept[n] += 1
+    return [(label, items[:n]) for (label, items), n in zip(rows, kept) if n]
+
+def render_sections(sections, mode="standard", use_labels=True, fmt="text", budget=0):
+    """Render (label, items) sections as text or JSON in one pass.
+
+    `items` is a list of strings (or one string). A positive `budget` (in
+    estimated tokens) trims items so the text output fits it.
+    """
+    transform, sep = BREVITY.get(mode, BREVITY["standard"])
+    rows = []
+    for label, content in sections:
+        if not content:
+            continue
+        items = list(content) if isinstance(content, (list, tuple)) else [str(content)]
+        rows.append((label, [transform(i) for i in items] if transform else items))
+    if budget and budget > 0 and rows:
+        rows = _fit(rows, sep, use_labels, budget * CHARS_PER_TOKEN)
+    if fmt == "json":
+        if use_labels:
+            return json.dumps({label: items for label, items in rows}, ensure_ascii=False)
+        return json.dumps([items for _, items in rows], ensure_ascii=False)
+    if use_labels:
+        return "\n".join(f"{label}: {sep.join(items)}" for label, items in rows)
+    return "\n".join(sep.join(items) for _, items in rows)
+
+def build_prompt(sections, mode="standard", use_labels=True):
+    return render_sections(sections, mode, use_labels)
+
+# -----------------------------
+# Base vocabulary (broad domains)
+# -----------------------------
+CHAR_ROLES = _kw(
+    "alchemist","warrior","mage","knight","mechanic","inventor","scholar","assassin","archer",
+    "priest","monk","sailor","pirate","captain","soldier","guard","queen","king","prince","princess",
+    "villager","merchant","scientist","engineer","android","cyborg","child","boy","girl","man","woman",
+    "elder","apprentice","master","mentor","student","teacher","hunter","ranger","witch","wizard","samurai",
+    "detective","hacker","pilot","smuggler","ranger","bard","cleric","vampire","occultist"
+)
+
+CLOTHING = _kw(
+    "coat","cloak","robe","hood","hooded","cape","armor","breastplate","gauntlets","boots","sandals",
+    "gloves","mask","goggles","scarf","belt","tunic","dress","skirt","trousers","pants","jacket",
+    "tattered","ragged","silk","leather","linen","chainmail","kimono","trench coat","fedora"
+)
+
+PHYS_ATTR = _kw(
+    "tall","short","lean","muscular","slim","stocky","scarred","freckled","tattooed","bearded",
+    "bald","long hair","short hair","silver hair","black hair","blonde hair","red hair","brown hair",
+    "blue eyes","green eyes","brown eyes","grey eyes","golden eyes","sharp eyes","pale skin"
+)
+
+OBJECTS = _kw(
+    "sword","dagger","book","tome","scroll","pocketwatch","watch","gear","gears","cog","lantern",
+    "lamp","staff","wand","potion","vial","flask","orb","crystal","compass","map","quill","feather",
+    "hammer","wrench","tool","tools","machine","device","bracelet","amulet","ring","necklace",
+    "chain","clock","hourglass","violin","gun","rifle","blaster","drone","camera","smartphone"
+)
+
+ENVIRONMENTS = _kw(
+    "workshop","lab","laboratory","library","forge","factory","market","alley","street","castle","throne room",
+    "dungeon","forest","woods","jungle","desert","oasis","cave","mountain","cliff","harbor","port","ship","deck",
+    "sky","clouds","city","village","ruins","temple","cathedral","church","graveyard","garden","field","meadow",
+    "river","lake","waterfall","swamp","sewer","tower","observatory","cafe","apartment","park","train station"
+)
+
+TIME_OF_DAY = _kw("dawn","sunrise","morning","noon","afternoon","sunset","twilight","dusk","night","midnight","golden hour")
+WEATHER = _kw("rain","storm","snow","fog","mist","smoke","wind","windy","thunder","lightning","dust","sandstorm","smog")
+
+LIGHTING = _kw(
+    "light","lit","glow","glowing","illumination","highlight","rim light","backlight","backlit","lantern light",
+    "torchlight","candlelight","neon","bioluminescent","sunbeam","god rays","volumetric light","soft light",
+    "hard light","contrast","shadow","shadows","dramatic shadows","low key","high key","silhouette","moonlight"
+)
+
+COLORS = _kw(
+    "gold","golden","amber","orange","red","crimson","scarlet","pink","magenta","purple","violet","blue",
+    "cyan","teal","green","emerald","lime","yellow","warm","cool","monochrome","sepia","brass","copper","silver"
+)
+
+CAMERA = _kw(
+    "close-up","close up","extreme close-up","portrait","bust","mid-shot","medium shot","cowboy shot",
+    "wide shot","long shot","establishing shot","low angle","high angle","bird's-eye view","top-down",
+    "over-the-shoulder","dutch angle","tilt","pan","tracking shot","depth of field","bokeh","rule of thirds","centered"
+)
+
+COMPOSITION = _kw(
+    "symmetry","asymmetry","leading lines","foreground","midground","background","negative space",
+    "framing","vignette","dynamic pose","profile","three-quarter view","silhouette"
+)
+
+MOOD = _kw(
+    "tense","mysterious","ominous","melancholic","somber","hopeful","serene","epic","dramatic",
+    "whimsical","romantic","grim","triumphant","anxious","calm","chaotic","majestic","mournful","noir","nostalgic"
+)
+
+STYLE = _kw(
+    "anime","motion graphics","cinematic","cell shaded","cel-shaded","manga","illustration","hand-drawn",
+    "comic","realistic","photoreal","painterly","watercolor","oil painting","ink","line art","cyberpunk","steampunk"
+)
+
+QUALITY = _kw(
+    "highly detailed","ultra detailed","sharp focus","crisp lines","4k","uhd","hdr","global illumination","film grain"
+)
+
+EFFECTS = _kw("sparks","embers","smoke","steam","dust","particles","glitter","rain droplets","snowflakes","lens flare","glitches")
+
+VOCAB = {
+    "CHAR_ROLES": CHAR_ROLES, "CLOTHING": CLOTHING, "PHYS_ATTR": PHYS_ATTR, "OBJECTS": OBJECTS,
+    "ENVIRONMENTS": ENVIRONMENTS, "TIME_OF_DAY": TIME_OF_DAY, "WEATHER": WEATHER, "LIGHTING": LIGHTING,
+    "COLORS": COLORS, "CAMERA": CAMERA, "COMPOSITION": COMPOSITION, "MOOD": MOOD, "STYLE": STYLE,
+    "QUALITY": QUALITY, "EFFECTS": EFFECTS,
+}
+
+# -----------------------------
+# Style Presets (expanded)
+# -----------------------------
+STYLE_PRESETS = {
+    "Motion Graphics Anime (default)": ["cinematic","anime","motion graphics","highly detailed","dramatic shadows","crisp lines"],
+    "Cel-Shaded Anime": ["anime","cel-shaded","clean line art","bold shadows","saturated color"],
+    "Realistic Cinematic": ["cinematic","realistic","volumetric light","film grain","hdr"],
+    "Painterly Fantasy": ["painterly","soft brushwork","textured canvas","romantic lighting"],
+    "Manga Ink": ["manga","ink","line art","screentone","high contrast"],
+    "Shōnen Action Anime": ["anime","dynamic pose","speedlines","high contrast","saturated color"],
+    "Studio Ghibli Soft": ["painterly","soft edges","warm palette","natural light","gentle shading"],
+    "Manga Black & White": ["black and white","high contrast","inked lines","screentone"],
+    "Watercolor Illustration": ["watercolor","soft gradients","paper texture","pastel palette"],
+    "Film Noir Cinematic": ["black and white","low key","venetian blinds","hard contrast","grain"],
+    "Golden Age Hollywood": ["cinematic","technicolor palette","glamour lighting","film grain"],
+    "Ultra-Realistic 3D Render": ["photoreal","raytracing","global illumination","sharp focus","hdr"],
+    "Documentary Natural Light": ["handheld feel","natural light","minimal grading","realistic"],
+    "Cyberpunk Neon": ["cyberpunk","neon glow","rain reflections","holographic spill","high contrast"],
+    "Retro Sci-Fi Pulp": ["pulp illustration","halftone","flat colors","retro futurism"],
+    "Synthwave / Vaporwave": ["retro","neon gradient","gridlines","glow","80s aesthetic"],
+    "Mecha Anime": ["anime","mechanical precision","metallic texture","dramatic low angle"],
+    "Steampunk Illustration": ["steampunk","sepia tint","brass and copper","industrial shading"],
+    "Dieselpunk Grit": ["gritty","smoky atmosphere","muted palette","industrial"],
+    "Pop Art Comic": ["bold outlines","halftone dots","primary colors","comic frame"],
+    "Surrealist Dreamscape": ["surreal","warped perspective","dreamlike lighting","ethereal"],
+    "Mythic African Epic": ["bold patterns","earthy palette","spiritual glow","ceremonial motifs"],
+    "Celestial Cosmic Fantasy": ["cosmic nebulae","glow","ethereal","starfields"]
+}
+
+# -----------------------------
+# Story Packs (built-in + expanded)
+# -----------------------------
+STORY_PACKS = {
+    "General (Default)": {k: [] for k in ["CHAR_ROLES","CLOTHING","PHYS_ATTR","OBJECTS","ENVIRONMENTS","TIME_OF_DAY","WEATHER","LIGHTING","COLORS","CAMERA","COMPOSITION","MOOD","STYLE","QUALITY","EFFECTS"]},
+    "The Clockwork Alchemist": {
+        "CHAR_ROLES": ["alchemist","mechanist","guildmaster","automaton","clockmaker","airship captain","apprentice"],
+        "CLOTHING": ["brass goggles","mechanical gauntlet","leather harness","tattered coat","oil-stained gloves","clockwork prosthetic"],
+        "PHYS_ATTR": ["soot-smudged","grease-streaked","silver hair","sharp eyes"],
+        "OBJECTS": ["brass pocketwatch","ether vial","alchemical sigil","rune plate","spring coil","pressure gauge","gearwork heart","steam valve","arc lamp"],
+        "ENVIRONMENTS": ["clockwork workshop","gilded laboratory","observatory tower","airship deck","steamworks","gear hall","cobblestone alley","ruined cathedral","boiler room"],
+        "TIME_OF_DAY": ["gaslamp night","dawn fog"],
+        "WEATHER": ["sooty haze","steam plume","industrial fog"],
+        "LIGHTING": ["lantern glow","arc light","flicker light","volumetric steam light"],
+        "COLORS": ["brass","copper","verdigris","oil-sheen"],
+        "CAMERA": ["close-up","mid-shot","wide shot","low angle","high angle","over-the-shoulder","dutch angle"],
+        "COMPOSITION": ["foreground gears","backlit silhouette","leading lines of pipes"],
+        "MOOD": ["tense","mysterious","epic","melancholic","triumphant"],
+        "STYLE": ["steampunk","anime","cinematic"],
+        "QUALITY": ["highly detailed","crisp lines","4k","dramatic shadows"],
+        "EFFECTS": ["sparks","embers","steam","dust motes"]
+    },
+    "Neon Sci-Fi / Cyberpunk": {
+        "CHAR_ROLES": ["netrunner","android","street samurai","corporate agent","hacker","detective"],
+        "CLOTHING": ["neon jacket","visored helmet","techwear cloak","fiber-optic hair","chrome prosthetic"],
+        "PHYS_ATTR": ["augmented eyes","cybernetic arm","holographic tattoos"],
+        "OBJECTS": ["neon katana","data shard","holo-screen","drone","plasma pistol","aug rig"],
+        "ENVIRONMENTS": ["rain-soaked alley","rooftop skyline","arcology lobby","night market","megacity block"],
+        "TIME_OF_DAY": ["night","dawn"],
+        "WEATHER": ["rain","mist","smog"],
+        "LIGHTING": ["neon glow","backlit signage","hologram spill"],
+        "COLORS": ["magenta","cyan","electric blue","acid green"],
+        "CAMERA": ["low angle","wide shot","over-the-shoulder","close-up"],
+        "COMPOSITION": ["reflections in puddles","crowded background","silhouette in signage"],
+        "MOOD": ["tense","noir","rebellious","grim"],
+        "STYLE": ["cyberpunk","anime","cinematic"],
+        "QUALITY": ["highly detailed","hdr","crisp lines"],
+        "EFFECTS": ["rain droplets","steam","glitches","lens flare"]
+    },
+    "Medieval High Fantasy": {
+        "CHAR_ROLES": ["knight","sorceress","ranger","bard","cleric","dragon","queen","king","orc","elf"],
+        "CLOTHING": ["plate armor","chainmail","tabard","hooded cloak","wizard robe","leather boots"],
+        "PHYS_ATTR": ["pointed ears","scarred","braided hair","emerald eyes"],
+        "OBJECTS": ["longsword","spellbook","crystal staff","enchanted bow","shield","chalice"],
+        "ENVIRONMENTS": ["castle hall","enchanted forest","mountain pass","ancient ruins","village square"],
+        "TIME_OF_DAY": ["dawn","sunset","night"],
+        "WEATHER": ["fog","snow","storm"],
+        "LIGHTING": ["torchlight","moonlight","sunbeams","god rays"],
+        "COLORS": ["emerald","gold","crimson","sapphire"],
+        "CAMERA": ["establishing shot","low angle","wide shot","close-up"],
+        "COMPOSITION": ["leading lines","foreground foliage","backlit silhouette"],
+        "MOOD": ["epic","mystical","hopeful","ominous"],
+        "STYLE": ["anime","painterly","cinematic"],
+        "QUALITY": ["highly detailed","4k","dramatic shadows"],
+        "EFFECTS": ["embers","dust motes","sparkles","magic particles"]
+    },
+    "Gothic Horror": {
+        "CHAR_ROLES": ["vampire","occultist","nun","priest","monster hunter","ghost"],
+        "CLOTHING": ["victorian dress","tailcoat","veil","leather gloves","fetters"],
+        "PHYS_ATTR": ["pale skin","bloodshot eyes","gaunt","fangs"],
+        "OBJECTS": ["candle","crucifix","silver dagger","coffin","grimoire"],
+        "ENVIRONMENTS": ["ruined chapel","graveyard","crypt","foggy street","abandoned manor"],
+        "TIME_OF_DAY": ["midnight","dusk"],
+        "WEATHER": ["fog","rain","storm"],
+        "LIGHTING": ["candlelight","moonlight","low key","hard shadows"],
+        "COLORS": ["sepia","scarlet","ashen blue","black"],
+        "CAMERA": ["dutch angle","close-up","high angle","long shot"],
+        "COMPOSITION": ["heavy vignette","negative space","arched frames"],
+        "MOOD": ["ominous","mournful","tense","macabre"],
+        "STYLE": ["noir","painterly","cinematic"],
+        "QUALITY": ["highly detailed","grain","dramatic shadows"],
+        "EFFECTS": ["mist","motes","blood spatter"]
+    },
+    "Space Opera": {
+        "CHAR_ROLES": ["pilot","admiral","smuggler","alien envoy","trooper","astromech"],
+        "CLOTHING": ["flight suit","cape","armor plating","vac suit"],
+        "PHYS_ATTR": ["glowing eyes","bioluminescent skin","horns","tendrils"],
+        "OBJECTS": ["blaster","holomap","starfighter","hyperdrive core","laser sword"],
+        "ENVIRONMENTS": ["starship bridge","hangar bay","desert planet","ice moon","asteroid base"],
+        "TIME_OF_DAY": ["night","dawn"],
+        "WEATHER": ["solar wind","dust storm","snow"],
+        "LIGHTING": ["console glow","starlight","volumetric beams"],
+        "COLORS": ["azure","violet","burnt orange","silver"],
+        "CAMERA": ["wide shot","over-the-shoulder","top-down","low angle"],
+        "COMPOSITION": ["rule of thirds","epic scale","foreground cockpit"],
+        "MOOD": ["heroic","urgent","mysterious"],
+        "STYLE": ["cinematic","anime","illustration"],
+        "QUALITY": ["hdr","highly detailed","4k"],
+        "EFFECTS": ["sparks","debris","engine trails","laser bolts"]
+    },
+    "Noir Detective": {
+        "CHAR_ROLES": ["detective","femme fatale","mobster","cop","bartender"],
+        "CLOTHING": ["trench coat","fedora","three-piece suit","evening gown","gloves"],
+        "PHYS_ATTR": ["cigarette smoke","stubbled chin","shadowed eyes"],
+        "OBJECTS": ["revolver","briefcase","whisky glass","matchbook","photograph"],
+        "ENVIRONMENTS": ["rainy street","jazz club","motel room","police station","office with blinds"],
+        "TIME_OF_DAY": ["night","late evening"],
+        "WEATHER": ["rain","fog"],
+        "LIGHTING": ["venetian blind light","low key","hard contrast","neon sign"],
+        "COLORS": ["monochrome","sepia","scarlet accent"],
+        "CAMERA": ["close-up","low angle","over-the-shoulder"],
+        "COMPOSITION": ["silhouette","strong diagonals","negative space"],
+        "MOOD": ["noir","tense","melancholic"],
+        "STYLE": ["black and white","cinematic","pulp illustration"],
+        "QUALITY": ["grain","high contrast","sharp focus"],
+        "EFFECTS": ["rain droplets","cigarette smoke"]
+    },
+    "Modern Romance / Slice of Life": {
+        "CHAR_ROLES": ["student","teacher","office worker","musician","photographer"],
+        "CLOTHING": ["hoodie","sundress","school uniform","suit and tie","denim jacket"],
+        "PHYS_ATTR": ["smiling eyes","rosy cheeks"],
+        "OBJECTS": ["smartphone","coffee cup","bouquet","guitar","notebook"],
+        "ENVIRONMENTS": ["café","apartment balcony","park bench","train station","beach at sunset"],
+        "TIME_OF_DAY": ["golden hour","evening","morning"],
+        "WEATHER": ["clear","drizzle"],
+        "LIGHTING": ["warm lamp glow","soft daylight","neon reflections"],
+        "COLORS": ["pastel","warm tones"],
+        "CAMERA": ["portrait","close-up","mid-shot"],
+        "COMPOSITION": ["rule of thirds","foreground bokeh"],
+        "MOOD": ["warm","tender","nostalgic","bittersweet"],
+        "STYLE": ["illustration","cinematic","anime"],
+        "QUALITY": ["sharp focus","soft grain"]
+    },
+    "Post-Apocalyptic Survival": {
+        "CHAR_ROLES": ["scavenger","wanderer","raider","survivor","mutant"],
+        "CLOTHING": ["gas mask","patched leather","tattered cloak","survival gear"],
+        "PHYS_ATTR": ["scarred","gaunt"],
+        "OBJECTS": ["crossbow","makeshift weapon","rusty car","canned food","broken radio"],
+        "ENVIRONMENTS": ["ruined city","desert wasteland","abandoned mall","collapsed highway","underground bunker"],
+        "TIME_OF_DAY": ["noon","sunset"],
+        "WEATHER": ["dust storm","smog","dry heat"],
+        "LIGHTING": ["harsh sunlight","flickering torch","smoke haze"],
+        "COLORS": ["desaturated","rust tones"],
+        "CAMERA": ["wide shot","low angle"],
+        "COMPOSITION": ["lonely silhouette","vast negative space"],
+        "MOOD": ["grim","hopeless","desperate","tense"],
+        "STYLE": ["cinematic","realistic"],
+        "QUALITY": ["grain","highly detailed"]
+    },
+    "Mythic Africa": {
+        "CHAR_ROLES": ["griot","warrior queen","rain shaman","hunter","ancestor spirit"],
+        "CLOTHING": ["kente cloth","beadwork","ceremonial masks","painted skin"],
+        "PHYS_ATTR": ["scarification patterns"],
+        "OBJECTS": ["drum","spear","calabash","ritual staff","amulet"],
+        "ENVIRONMENTS": ["savannah","baobab grove","sacred river","desert dunes","ancestral shrine"],
+        "TIME_OF_DAY": ["blazing noon","moonlit night"],
+        "WEATHER": ["dust wind","rainstorm"],
+        "LIGHTING": ["firelight","moonlit ritual glow"],
+        "COLORS": ["earthy palette","bold patterns"],
+        "CAMERA": ["establishing shot","low angle"],
+        "COMPOSITION": ["ceremonial procession","framed by trees"],
+        "MOOD": ["spiritual","majestic","solemn","powerful"],
+        "STYLE": ["painterly","cinematic"],
+        "QUALITY": ["highly detailed"]
+    },
+    "Arabian Nights Fantasy": {
+        "CHAR_ROLES": ["sultan","desert thief","genie","merchant","caravan guard"],
+        "CLOTHING": ["turbans","flowing robes","veils","gold jewelry","sandals"],
+        "PHYS_ATTR": ["kohl-lined eyes"],
+        "OBJECTS": ["magic lamp","scimitar","flying carpet","spice jar","treasure chest"],
+        "ENVIRONMENTS": ["desert oasis","palace hall","bazaar","caravan camp","hidden cave"],
+        "TIME_OF_DAY": ["starlit night","golden sunset"],
+        "WEATHER": ["hot wind","clear sky"],
+        "LIGHTING": ["torchlight","golden glow","starlight"],
+        "COLORS": ["saffron","turquoise","gold"],
+        "CAMERA": ["wide shot","low angle"],
+        "COMPOSITION": ["arched frames","flowing drapery"],
+        "MOOD": ["exotic","mysterious","enchanting","adventurous"],
+        "STYLE": ["painterly","cinematic","anime"],
+        "QUALITY": ["highly detailed"]
+    },
+    "Far East Mythology": {
+        "CHAR_ROLES": ["samurai","onmyoji","yokai","dragon spirit","shrine maiden"],
+        "CLOTHING": ["kimono","hakama","straw hat","bamboo armor"],
+        "PHYS_ATTR": ["fox ears","horns"],
+        "OBJECTS": ["katana","ofuda scroll","torii gate","shrine lantern","folding fan"],
+        "ENVIRONMENTS": ["bamboo forest","mountain shrine","misty lake","torii pathway","ancient village"],
+        "TIME_OF_DAY": ["misty dawn","moonlit night"],
+        "WEATHER": ["fog","snow"],
+        "LIGHTING": ["lantern glow","moonlight"],
+        "COLORS": ["indigo","vermillion","gold"],
+        "CAMERA": ["three-quarter view","low angle"],
+        "COMPOSITION": ["framed by torii","foreground reeds"],
+        "MOOD": ["serene","spiritual","mystical","foreboding"],
+        "STYLE": ["ink","painterly","anime"],
+        "QUALITY": ["crisp lines","highly detailed"]
+    },
+    "Prehistoric Adventure": {
+        "CHAR_ROLES": ["hunter-gatherer","tribal elder","cave child","shaman"],
+        "CLOTHING": ["furs","bones","animal hides","painted skin"],
+        "PHYS_ATTR": ["war paint"],
+        "OBJECTS": ["stone spear","fire torch","drum","flint knife"],
+        "ENVIRONMENTS": ["cave","volcanic plain","mammoth herd","river crossing","dense jungle"],
+        "TIME_OF_DAY": ["dawn","twilight"],
+        "WEATHER": ["ash fall","rain"],
+        "LIGHTING": ["firelight","volcanic glow","dawn mist"],
+        "COLORS": ["ochre","charcoal","earth tones"],
+        "CAMERA": ["wide shot","low angle"],
+        "COMPOSITION": ["petroglyph backdrop","smoke-filled air"],
+        "MOOD": ["primal","dangerous","awe-inspiring"],
+        "STYLE": ["painterly","cinematic"],
+        "QUALITY": ["textured brushwork","highly detailed"]
+    },
+    "Western Frontier": {
+        "CHAR_ROLES": ["cowboy","sheriff","outlaw","rancher","gambler"],
+        "CLOTHING": ["wide-brimmed hat","poncho","spurs","leather vest","bandana"],
+        "PHYS_ATTR": ["stubbled jaw"],
+        "OBJECTS": ["revolver","lasso","whiskey bottle","deck of cards","saddle"],
+        "ENVIRONMENTS": ["dusty town","saloon","desert canyon","train station","ranch"],
+        "TIME_OF_DAY": ["blazing noon","sunset silhouette"],
+        "WEATHER": ["dust wind","clear sky"],
+        "LIGHTING": ["harsh sun","lantern glow"],
+        "COLORS": ["sepia","sun-bleached tones"],
+        "CAMERA": ["cowboy shot","wide shot","low angle"],
+        "COMPOSITION": ["long shadow","doorway framing"],
+        "MOOD": ["gritty","tense","adventurous","lawless"],
+        "STYLE": ["cinematic","pulp illustration"],
+        "QUALITY": ["grain","highly detailed"]
+    }
+}
+
+# -----------------------------
+# Per-request vocabulary
+# -----------------------------
+def _layer_terms(layer, key):
+    terms = layer.get(key, [])
+    if isinstance(terms, str):
+        terms = [terms]
+    elif not isinstance(terms, (list, tuple, set, frozenset)):
+        return []
+    return [str(t).lower() for t in terms if str(t).strip()]
+
+# Spelling variants matched as their canonical term: "off", "forms"
+# (plural/singular, hyphen/space) or "typos" (forms + edit-distance-1 typos)
+MATCH_VARIANTS = os.environ.get("KLING_MATCH_VARIANTS", "forms")
+# Categories of nouns, the only terms that get plural/singular variants
+NOUN_CATEGORIES = ("CHAR_ROLES", "CLOTHING", "OBJECTS", "ENVIRONMENTS", "EFFECTS")
+
+class Vocabulary:
+    """Base vocabulary plus one story pack and an optional custom pack.
+
+    Frozen after construction (frozensets behind a read-only mapping), so a
+    single instance is shared between sessions; use get_vocabulary() rather
+    than building one directly.
+    """
+
+    __slots__ = ("terms", "digest", "matcher")
+
+    def __init__(self, layers, digest, variants=None):
+        variants = MATCH_VARIANTS if variants is None else variants
+        terms, featured = {}, set()
+        for key, base in VOCAB.items():
+            merged = set(base)
+            for layer in layers:
+                added = _layer_terms(layer, key)
+                merged.update(added)
+                featured.update(added)
+            terms[key] = frozenset(merged)
+        object.__setattr__(self, "terms", MappingProxyType(terms))
+        object.__setattr__(self, "digest", digest)
+        index = None
+        if variants != "off":
+            nouns = set().union(*(terms[key] for key in NOUN_CATEGORIES))
+            index = variant_index(set().union(*terms.values()), typos=variants == "typos", nouns=nouns)
+        object.__setattr__(self, "matcher", TermMatcher(terms, featured, index))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Vocabulary is immutable")
+
+    def __reduce__(self):
+        # Pickled as precompiled pack artifacts; the matcher is stored as built
+        return _restore_vocabulary, (dict(self.terms), self.digest, self.matcher)
+
+    def __getitem__(self, key):
+        return self.terms[key]
+
+def _restore_vocabulary(terms, digest, matcher):
+    vocab = object.__new__(Vocabulary)
+    object.__setattr__(vocab, "terms", MappingProxyType(terms))
+    object.__setattr__(vocab, "digest", digest)
+    object.__setattr__(vocab, "matcher", matcher)
+    return vocab
+
+def vocabulary_digest(*layers):
+    payload = [{k: sorted(_layer_terms(layer, k)) for k in VOCAB} for layer in layers if isinstance(layer, dict)]
+    raw = json.dumps([MATCH_VARIANTS, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class EngineCache:
+    """Bounded LRU of built vocabularies (terms + compiled matcher).
+
+    Keyed by (story pack name, custom pack digest); entries are evicted
+    least-recently-used first once either `capacity` entries or `max_bytes`
+    of estimated matcher memory is exceeded. Safe to share between threads:
+    concurrent requests for a missing key wait for a single build.
+    """
+
+    def __init__(self, capacity=32, max_bytes=256 << 20):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._building = {}  # key -> Event set once the build finishes
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build, stage=None):
+        built = False
+        while True:
+            with self._lock:
+                engine = self._entries.get(key)
+                if engine is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    break
+                pending = self._building.get(key)
+                owner = pending is None
+                if owner:
+                    pending = self._building[key] = threading.Event()
+                    self.misses += 1
+            if not owner:
+                pending.wait()  # another thread is building this key
+                continue
+            try:
+                engine = build()
+                built = True
+                with self._lock:
+                    self._entries[key] = engine
+                    self._bytes += engine.matcher.nbytes
+                    self._evict()
+            finally:
+                with self._lock:
+                    del self._building[key]
+                pending.set()
+            break
+        if stage is not None:
+            stage["cache_hits"] = int(not built)
+        return engine
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.capacity or self._bytes > self.max_bytes):
+            if len(self._entries) == 1:
+                break  # always keep the entry that was just built
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.matcher.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self._entries), "bytes": self._bytes,
+                "capacity": self.capacity, "max_bytes": self.max_bytes,
+            }
+
+ENGINE_CACHE = EngineCache(
+    capacity=int(os.environ.get("KLING_ENGINE_CACHE_SIZE", 32)),
+    max_bytes=int(float(os.environ.get("KLING_ENGINE_CACHE_MB", 256)) * (1 << 20)),
+)
+
+PACKS = PackRegistry(
+    STORY_PACKS, VOCAB,
+    build=lambda layers: Vocabulary(layers, vocabulary_digest(*layers)),
+    directory=os.environ.get("KLING_PACK_DIR") or None,
+    cache_dir=os.environ.get("KLING_PACK_CACHE_DIR") or None,
+    salt=vocabulary_digest(VOCAB),
+)
+
+def get_vocabulary(pack, custom_pack=None, stage=None, overlay=None):
+    """Shared vocabulary for a pack (+ custom pack). Vocabularies with a custom
+    pack are kept in `overlay` (an EngineCache, e.g. per session) when given,
+    otherwise in the process-wide ENGINE_CACHE. An unknown pack raises
+    ValueError rather than taking a cache slot."""
+    if pack not in PACKS:
+        raise ValueError(f"unknown story pack: {pack!r}")
+    custom = custom_pack if isinstance(custom_pack, dict) and custom_pack else None
+    if custom and sum(len(v) for v in custom.values() if isinstance(v, (list, tuple, set, frozenset))) > MAX_PACK_TERMS:
+        raise ValueError(f"custom pack: more than {MAX_PACK_TERMS} terms")
+    custom_digest = vocabulary_digest(custom) if custom else ""
+
+    def build():
+        if not custom:
+            return PACKS.vocabulary(pack)
+        layers = [PACKS.get(pack), custom]
+        return Vocabulary(layers, vocabulary_digest(*layers))
+
+    cache = overlay if custom and overlay is not None else ENGINE_CACHE
+    return cache.get_or_build((pack, custom_digest), build, stage)
+
+# -----------------------------
+# Pipeline
+# -----------------------------
+DEFAULT_PACK = "General (Default)"
+DEFAULT_STYLE = "Motion Graphics Anime (default)"
+
+RESULT_CACHE = ResultCache(
+    capacity=int(os.environ.get("KLING_RESULT_CACHE_SIZE", 1024)),
+    path=os.environ.get("KLING_RESULT_CACHE_DB") or None,
+)
+METRICS = Metrics.from_env()
+
+# Texts longer than MAX_INPUT_CHARS take the streaming path (bounded working
+# memory) and keep only the MAX_TERMS_PER_CATEGORY most relevant terms per
+# category; only the first MAX_SCAN_CHARS are read, which bounds latency
+MAX_INPUT_CHARS = int(os.environ.get("KLING_MAX_INPUT_CHARS", 200_000))
+MAX_TERMS_PER_CATEGORY = int(os.environ.get("KLING_MAX_TERMS_PER_CATEGORY", 30))
+MAX_SCAN_CHARS = int(os.environ.get("KLING_MAX_SCAN_CHARS", 1_000_000))
+
+CACHE_VERSION = 7  # bump when cached extraction/render results change shape or meaning
+
+def _digest(*parts):
+    raw = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+# Cached extractions hold term IDs, which are only stable for one base
+# vocabulary (PACKS.salt, which also covers MATCH_VARIANTS), and renders
+# depend on the presets, scoring and limits; a persistent cache must not
+# outlive a change to any of them.
+RESULT_SALT = _digest(CACHE_VERSION, PACKS.salt, STYLE_PRESETS, RELEVANCE_WEIGHTS, CHARS_PER_TOKEN,
+                      MAX_INPUT_CHARS, MAX_TERMS_PER_CATEGORY, MAX_SCAN_CHARS)
+
+def extract(text, vocab, trace=NULL_TRACE):
+    if len(text) > MAX_INPUT_CHARS:
+        return extract_oversized(text, vocab, trace)
+    with trace.stage("match_terms", chars=len(text), terms_scanned=len(vocab.matcher)) as st:
+        terms = vocab.matcher.find_all(text)
+        st["matches"] = len(terms.ids)
+    with trace.stage("proper_names", chars=len(text)) as st:
+        names = proper_names(text, vocab.matcher)
+        st["matches"] = len(names)
+    return {"names": names, "terms": terms}
+
+def extract_oversized(text, vocab, trace=NULL_TRACE):
+    """extract() for very long texts: chunked scan of the first MAX_SCAN_CHARS,
+    at most MAX_TERMS_PER_CATEGORY of the most relevant terms per category."""
+    from kling_stream import CHUNK_SIZE, NameStream, TermStream
+
+    terms, names = TermStream(vocab.matcher), NameStream(vocab.matcher)
+    end = min(len(text), MAX_SCAN_CHARS)
+    with trace.stage("match_terms", chars=end, terms_scanned=len(vocab.matcher), oversized=1) as st:
+        for i in range(0, end, CHUNK_SIZE):
+            chunk = text[i:min(i + CHUNK_SIZE, end)]
+            terms.feed(chunk)
+            names.feed(chunk)
+        matches = vocab.matcher.route(terms.close(), terms.length)
+        scores = relevance_scores(matches)
+        keep = set()
+        for ids in matches.by_category().values():
+            keep.update(top_terms(ids, MAX_TERMS_PER_CATEGORY, scores))
+        stats = {i: (c, f) for i, c, f in zip(matches.ids, matches.counts, matches.first) if i in keep}
+        matches = vocab.matcher.route(stats, matches.length)
+        st["matches"] = len(matches.ids)
+    with trace.stage("proper_names", chars=end) as st:
+        found = names.close()[:MAX_TERMS_PER_CATEGORY]
+        st["matches"] = len(found)
+    return {"names": found, "terms": matches}
+
+def extraction_key(text, vocab):
+    """Result cache key of extract(text, vocab).
+
+    An oversized text's extraction depends only on its first MAX_SCAN_CHARS,
+    so only those are hashed, a chunk at a time rather than JSON-encoding a
+    copy of the whole text.
+    """
+    if len(text) <= MAX_INPUT_CHARS:
+        return _digest(RESULT_SALT, vocab.digest, text)
+    h = hashlib.sha1(f"oversized:{RESULT_SALT}:{vocab.digest}:".encode("utf-8"))
+    for i in range(0, min(len(text), MAX_SCAN_CHARS), 1 << 16):
+        h.update(text[i:min(i + (1 << 16), MAX_SCAN_CHARS)].encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+def cached_extract(text, vocab, cache=RESULT_CACHE, key=None, trace=NULL_TRACE):
+    key = key or extraction_key(text, vocab)
+    with trace.stage("extract") as st:
+        hit = cache.extractions.get(key)
+        st["cache_hits"] = int(hit is not None)
+        if hit is not None:
+            terms = TermMatches(vocab.matcher, hit["ids"], hit["counts"], hit["first"], hit["length"])
+            return {"names": hit["names"], "terms": terms}
+        extraction = extract(text, vocab, trace)
+        terms = extraction["terms"]
+        cache.extractions.set(key, {
+            "names": extraction["names"], "ids": terms.ids.tolist(), "counts": terms.counts.tolist(),
+            "first": terms.first.tolist(), "length": terms.length,
+        })
+    return extraction
+
+def compose_sections(extraction, style_choice=DEFAULT_STYLE, max_items=10,
+                     char_name="", char_sheet="", negative=""):
+    """[(label, [items])] in prompt order; render with build_prompt()/render_sections()."""
+    # Term strings are materialized here, once per category; extraction works on IDs.
+    # Sections capped by max_items keep their most relevant terms, not the longest.
+    matches = extraction["terms"]
+    terms = matches.matcher.terms
+    ids = matches.by_category()
+    found = {cat: [terms[i] for i in cat_ids] for cat, cat_ids in ids.items()}
+    scores = None
+
+    def best(*categories, limit=max_items):
+        nonlocal scores
+        picked = [i for cat in categories for i in ids[cat]]
+        if limit and limit > 0 and len(picked) > limit:
+            if scores is None:
+                scores = relevance_scores(matches)
+            picked = top_terms(picked, limit, scores)
+        return [terms[i] for i in picked]
+
+    names = extraction["names"]
+    if char_name and char_name not in names:
+        names = [char_name] + names
+
+    char_sheet = char_sheet.strip() if char_sheet else ""
+    char_items = names[:2] + found["CHAR_ROLES"] + ([char_sheet] if char_sheet else [])
+    char_items += found["PHYS_ATTR"] + found["CLOTHING"]
+
+    # max_items caps these two sections by category group, not by term
+    lighting = compress_list([found[k] for k in ("COLORS", "LIGHTING", "TIME_OF_DAY", "WEATHER") if found[k]], max_items)
+    camera = compress_list([found[k] for k in ("CAMERA", "COMPOSITION") if found[k]], max_items)
+
+    # Preset terms always lead; matched style terms compete for the remaining slots
+    style_bits = list(STYLE_PRESETS.get(style_choice, []))
+    style_bits.extend(best("STYLE", "QUALITY", "EFFECTS", limit=max_items - len(style_bits)))
+
+    sections = [
+        ("Main Character", char_items),
+        ("Secondary / Objects", best("OBJECTS")),
+        ("Environment / Background", best("ENVIRONMENTS")),
+        ("Lighting & Color", [t for group in lighting for t in group]),
+        ("Camera & Composition", [t for group in camera for t in group]),
+        ("Mood / Emotion", best("MOOD")),
+        ("Style & Quality", compress_list(style_bits, max_items)),
+    ]
+    negative = negative.strip() if negative else ""
+    if negative:
+        sections.append(("Negative", [negative]))
+    return sections
+
+def render_prompt(extraction, style=DEFAULT_STYLE, brevity="standard", labels=True, max_items=10,
+                  char_name="", char_sheet="", negative="", fmt="text", budget=0, trace=NULL_TRACE):
+    with trace.stage("render"):
+        sections = compose_sections(extraction, style, max_items, char_name, char_sheet, negative)
+        return render_sections(sections, brevity, labels, fmt, budget)
+
+def perfect_prompt(text, pack=DEFAULT_PACK, style=DEFAULT_STYLE, brevity="standard", labels=True,
+                   max_items=10, char_name="", char_sheet="", negative="", custom_pack=None,
+                   fmt="text", budget=0, cache=RESULT_CACHE, trace=None, overlay=None):
+    """Turn scene text into a Kling prompt.
+
+    `fmt` is "text" or "json" (sections as {label: [items]}); a positive
+    `budget` trims the prompt to about that many tokens.
+
+    Pass a kling_metrics.Trace as `trace` to get per-stage timings for this
+    call even when process-wide METRICS are disabled, and an EngineCache as
+    `overlay` to keep custom-pack vocabularies out of the shared cache.
+    """
+    text = text or ""
+    trace = METRICS.trace() if trace is None else trace
+    with trace.stage("vocabulary") as st:
+        vocab = get_vocabulary(pack, custom_pack, st, overlay)
+    if cache is None:
+        extraction = extract(text, vocab, trace)
+        prompt = render_prompt(extraction, style, brevity, labels, max_items, char_name, char_sheet, negative,
+                               fmt, budget, trace)
+        METRICS.record(trace)
+        return prompt
+
+    key = extraction_key(text, vocab)
+    render_key = _digest(key, style, max_items, char_name, char_sheet, negative, brevity, labels, fmt, budget)
+    with trace.stage("render_cache") as st:
+        prompt = cache.renders.get(render_key)
+        st["cache_hits"] = int(prompt is not None)
+    if prompt is None:
+        extraction = cached_extract(text, vocab, cache, key, trace)
+        prompt = render_prompt(extraction, style, brevity, labels, max_items, char_name, char_sheet, negative,
+                               fmt, budget, trace)
+        cache.renders.set(render_key, prompt)
+    METRICS.record(trace)
+    return prompt
+
+class Engine:
+    """The process-wide pipeline state, shared by every session and thread.
+
+    Bundles the story pack registry, the vocabulary LRU (ENGINE_CACHE) and
+    the result cache. Vocabularies are immutable and the caches lock
+    internally, so any number of threads may call perfect() at once and
+    memory does not grow with the number of sessions. Each session keeps
+    its custom-pack vocabularies in its own small overlay (new_overlay()),
+    so one user's uploads neither evict the shared packs nor outlive the
+    session.
+    """
+
+    def __init__(self):
+        self.packs = PACKS
+        self.vocabularies = ENGINE_CACHE
+        self.cache = RESULT_CACHE
+        self.metrics = METRICS
+
+    def new_overlay(self, capacity=2):
+        return EngineCache(capacity=capacity, max_bytes=self.vocabularies.max_bytes)
+
+    def vocabulary(self, pack, custom_pack=None, overlay=None):
+        return get_vocabulary(pack, custom_pack, overlay=overlay)
+
+    def perfect(self, text, overlay=None, **options):
+        return perfect_prompt(text, cache=self.cache, overlay=overlay, **options)
+
+    def profile(self, text, overlay=None, **options):
+        """profile_prompt() for one input: the prompt plus cProfile and sampled-stack profiles.
+
+        The engine is shared by every session, so the process-wide GIL switch
+        interval is left alone (fast_switch=False).
+        """
+        from kling_profile import profile_prompt
+
+        return profile_prompt(text, overlay=overlay, fast_switch=False, **options)
+
+    def stats(self):
+        return {"vocabularies": self.vocabularies.stats(), "results": self.cache.stats()}
@@ -0,0 +1,192 @@
+"""Per-stage timing and counters for the perfect_prompt pipeline.
+
+Every request can carry a Trace: an ordered list of stage records (wall
+time plus counters such as input chars, terms scanned, matches, cache
+hits). Finished traces are folded into process-wide aggregates and handed
+to exporters (log lines, a Prometheus-style text endpoint).
+
+Disabled metrics hand out NULL_TRACE, whose stages are a shared no-op, so
+the instrumented pipeline costs a few attribute lookups per request.
+
+    KLING_METRICS=1          enable aggregation
+    KLING_METRICS_LOG=1      also log one JSON line per request (logger "kling.metrics")
+    KLING_METRICS_PORT=9108  also serve /metrics in Prometheus text format
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+_perf = time.perf_counter
+
+
+class _Stage(dict):
+    __slots__ = ("_trace", "_t0", "_parent")
+
+    def __enter__(self):
+        self._parent = self._trace.current
+        self._trace.current = self["stage"]
+        self._t0 = _perf()
+        return self
+
+    def __exit__(self, *exc):
+        self["ms"] = (_perf() - self._t0) * 1e3
+        self._trace.current = self._parent
+        return False
+
+
+class Trace:
+    """Stage records for one request, in the order the stages started."""
+
+    def __init__(self):
+        self.stages = []
+        self.current = None
+        self._t0 = _perf()
+        self.total_ms = None
+
+    def stage(self, name, **counters):
+        st = _Stage(stage=name, **counters)
+        st._trace = self
+        self.stages.append(st)
+        return st
+
+    def finish(self):
+        if self.total_ms is None:
+            self.total_ms = (_perf() - self._t0) * 1e3
+        return self
+
+    def as_dict(self):
+        return {"total_ms": self.total_ms, "stages": [dict(s) for s in self.stages]}
+
+    def __bool__(self):
+        return True
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class _NullTrace:
+    __slots__ = ()
+    current = None
+    _stage = _NullStage()
+
+    def stage(self, name, **counters):
+        return self._stage
+
+    def finish(self):
+        return self
+
+    def __bool__(self):
+        return False
+
+
+NULL_TRACE = _NullTrace()
+
+
+class LogExporter:
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("kling.metrics")
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, json.dumps(record, default=str))
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.exporters = []
+        self.requests = 0
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def trace(self):
+        return Trace() if self.enabled else NULL_TRACE
+
+    def record(self, trace):
+        trace.finish()
+        if not (self.enabled and trace):
+            return
+        with self._lock:
+            self.requests += 1
+            for st in trace.stages:
+                agg = self._stages.setdefault(st["stage"], {"calls": 0, "ms": 0.0})
+                agg["calls"] += 1
+                for key, value in st.items():
+                    if key == "stage" or isinstance(value, str):
+                        continue
+                    agg[key] = agg.get(key, 0) + value
+        if self.exporters:
+            record = trace.as_dict()
+            for export in self.exporters:
+                export(record)
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "stages": {k: dict(v) for k, v in self._stages.items()}}
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self._stages.clear()
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = ["# TYPE kling_requests_total counter", f"kling_requests_total {snap['requests']}"]
+        metrics = {}
+        for stage, agg in snap["stages"].items():
+            for key, value in agg.items():
+                name = "kling_stage_seconds_total" if key == "ms" else f"kling_stage_{key}_total"
+                metrics.setdefault(name, []).append((stage, value / 1e3 if key == "ms" else value))
+        for name, samples in sorted(metrics.items()):
+            lines.append(f"# TYPE {name} counter")
+            lines += [f'{name}{{stage="{stage}"}} {float(value):g}' for stage, value in samples]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics from a daemon thread; returns the HTTP server."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="kling-metrics", daemon=True).start()
+        return server
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        metrics = cls(enabled=environ.get("KLING_METRICS", "") not in ("", "0"))
+        if metrics.enabled and environ.get("KLING_METRICS_LOG", "") not in ("", "0"):
+            metrics.exporters.append(LogExporter())
+        if metrics.enabled and environ.get("KLING_METRICS_PORT"):
+            try:
+                metrics.serve(int(environ["KLING_METRICS_PORT"]))
+            except OSError as e:  # another process (e.g. a batch worker) already owns the port
+                logging.getLogger("kling.metrics").warning("metrics endpoint not started: %s", e)
+        return metrics
@@ -0,0 +1,180 @@
+"""Story pack registry: built-in packs plus a directory of JSON packs.
+
+Directory packs (`<dir>/<Pack Name>.json`, same shape as a custom pack) are
+only listed at startup; each one is read, validated and compiled the first
+time it is used. The built Vocabulary (normalized terms + matcher) is then
+pickled to `<dir>/.kling-cache/`, keyed by the file's size and mtime, so
+later processes load it instead of rebuilding it. Startup and switching
+packs do not depend on how many packs the directory holds.
+
+The cache directory holds pickles written by this process; do not point it
+at untrusted locations.
+
+Custom packs come from users (uploads, pasted JSON, batch rows, HTTP
+requests), so load_pack() reads at most MAX_PACK_BYTES and validate_pack()
+enforces MAX_PACK_TERMS / MAX_TERM_CHARS and drops terms the base
+vocabulary already has; all three are configurable through the environment.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+ARTIFACT_VERSION = 6
+METADATA_KEYS = ("name", "description", "version")
+
+MAX_PACK_BYTES = int(os.environ.get("KLING_MAX_PACK_BYTES", 1 << 20))
+MAX_PACK_TERMS = int(os.environ.get("KLING_MAX_PACK_TERMS", 5000))
+MAX_TERM_CHARS = int(os.environ.get("KLING_MAX_TERM_CHARS", 80))
+_READ_SIZE = 64 * 1024
+
+
+def validate_pack(data, categories, source="pack", known=None, max_terms=None, max_term_chars=None):
+    """Return `data` normalized to {category: [lowercase terms]}, or raise ValueError.
+
+    Terms already in `known[category]` are dropped; `max_terms` caps the
+    remaining total and `max_term_chars` the length of any one term.
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"{source}: expected a JSON object mapping categories to term lists")
+    unknown = sorted(k for k in data if k not in categories and k not in METADATA_KEYS)
+    if unknown:
+        raise ValueError(f"{source}: unknown categories {', '.join(map(repr, unknown))}")
+    pack, total = {}, 0
+    for key in categories:
+        terms = data.get(key, [])
+        if isinstance(terms, str):
+            terms = [terms]
+        if not isinstance(terms, list):
+            raise ValueError(f"{source}: {key} must be a list of strings")
+        if max_terms is not None and len(terms) > max_terms:
+            raise ValueError(f"{source}: more than {max_terms} terms")
+        existing = known.get(key, ()) if known is not None else ()
+        seen = {}
+        for term in terms:
+            if isinstance(term, (dict, list)):
+                raise ValueError(f"{source}: {key} must be a list of strings")
+            term = str(term).lower()
+            if max_term_chars is not None and len(term) > max_term_chars:
+                raise ValueError(f"{source}: {key} term longer than {max_term_chars} characters: {term[:40]!r}...")
+            if term.strip() and term not in existing:
+                seen.setdefault(term, None)
+        if seen:
+            pack[key] = list(seen)
+            total += len(seen)
+            if max_terms is not None and total > max_terms:
+                raise ValueError(f"{source}: more than {max_terms} terms")
+    return pack
+
+
+def load_pack(source, categories, name="custom pack", known=None,
+              max_bytes=MAX_PACK_BYTES, max_terms=MAX_PACK_TERMS, max_term_chars=MAX_TERM_CHARS):
+    """Parse and validate an untrusted pack from bytes, str or a file object.
+
+    File objects are read in chunks and abandoned as soon as they exceed
+    `max_bytes`, so an oversized upload is never held in full.
+    """
+    if hasattr(source, "read"):
+        parts, size = [], 0
+        while True:
+            chunk = source.read(_READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f"{name}: larger than {max_bytes} bytes")
+            parts.append(chunk)
+        source = type(parts[0])().join(parts) if parts else b""
+    elif len(source) > max_bytes:
+        raise ValueError(f"{name}: larger than {max_bytes} bytes")
+    try:
+        data = json.loads(source)
+    except ValueError as e:
+        raise ValueError(f"{name}: invalid JSON ({e})") from None
+    return validate_pack(data, categories, source=name, known=known, max_terms=max_terms, max_term_chars=max_term_chars)
+
+
+class PackRegistry:
+    def __init__(self, builtin, categories, build, directory=None, cache_dir=None, salt=""):
+        self.builtin = builtin
+        self.salt = salt  # changes whenever the base vocabulary does, invalidating artifacts
+        self.categories = tuple(categories)
+        self.directory = directory
+        self.cache_dir = cache_dir or (os.path.join(directory, ".kling-cache") if directory else None)
+        self._build = build
+        self._files = {}
+        self._packs = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        files = {}
+        if self.directory and os.path.isdir(self.directory):
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".json") and entry.is_file():
+                        files[entry.name[:-5]] = entry.path
+        with self._lock:
+            self._files = files
+            self._packs.clear()
+
+    def names(self):
+        return list(self.builtin) + sorted(n for n in self._files if n not in self.builtin)
+
+    def __contains__(self, name):
+        return name in self.builtin or name in self._files
+
+    def get(self, name, default=None):
+        if name in self.builtin:
+            return self.builtin[name]
+        path = self._files.get(name)
+        if path is None:
+            return default
+        with self._lock:
+            pack = self._packs.get(name)
+        if pack is None:
+            with open(path, encoding="utf-8") as f:
+                try:
+                    data = json.load(f)
+                except ValueError as e:
+                    raise ValueError(f"{path}: invalid JSON ({e})") from None
+            pack = validate_pack(data, self.categories, source=path)
+            with self._lock:
+                self._packs[name] = pack
+        return pack
+
+    def _artifact_path(self, name, path):
+        st = os.stat(path)
+        key = f"{ARTIFACT_VERSION}:{self.salt}:{name}:{st.st_size}:{st.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}.{digest}.pickle")
+
+    def vocabulary(self, name):
+        """Built Vocabulary for one pack, from its precompiled artifact when available."""
+        if name not in self:
+            raise ValueError(f"unknown story pack: {name!r}")
+        path = self._files.get(name) if name not in self.builtin else None
+        if path is None or not self.cache_dir:
+            return self._build([self.get(name)])
+        artifact = self._artifact_path(name, path)
+        try:
+            with open(artifact, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+        vocab = self._build([self.get(name)])
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{artifact}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(vocab, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, artifact)
+            stale = glob.glob(os.path.join(glob.escape(self.cache_dir), glob.escape(name) + "." + "[0-9a-f]" * 16 + ".pickle"))
+            for old in stale:
+                if old != artifact:
+                    os.remove(old)
+        except OSError:
+            pass  # read-only pack directory: keep working without artifacts
+        return vocab
@@ -0,0 +1,147 @@
+"""Opt-in profiling of the full prompt pipeline for one input.
+
+profile_prompt() runs perfect_prompt() with the result cache bypassed, so
+vocabulary lookup, extraction and rendering all execute, in two passes:
+
+- once under cProfile, for a deterministic profile (pstats_bytes() is
+  what `python -m pstats`, snakeviz and gprof2dot read);
+- repeatedly for `duration` seconds while a background thread samples
+  the call stack every `interval` seconds. Each sample is tagged with the
+  pipeline stage (Trace.current) it was taken in and comes out as a
+  collapsed stack, e.g. `stage:match_terms;kling_core:perfect_prompt;...`,
+  the format flamegraph.pl, inferno and speedscope read.
+
+With `cold=True` (the default) a custom pack's vocabulary is rebuilt on
+every run, so a pathological pack shows its build cost; story pack
+vocabularies come from the shared cache either way.
+
+So that the sampler gets the GIL on time, the process-wide switch interval
+is lowered during the sampling pass. Profiles run one at a time per
+process. Pass `fast_switch=False` in a process that serves other users
+(Engine.profile() does, for the app); the interval is then left alone and
+samples come less often under load.
+
+    result = profile_prompt(text, pack="Noir Detective", custom_pack=pack)
+    print(result.summary())
+    open("scene.pstats", "wb").write(result.pstats_bytes())
+    open("scene.folded", "w").write(result.collapsed())
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+from kling_core import EngineCache, perfect_prompt
+from kling_metrics import Trace
+
+# sys.setswitchinterval() is process-wide: concurrent profiles would restore each other's lowered value
+_LOCK = threading.Lock()
+
+
+def _label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _run(text, options, trace, cold):
+    overlay = EngineCache(capacity=1) if cold else options.get("overlay")
+    return perfect_prompt(text, **dict(options, cache=None, trace=trace, overlay=overlay))
+
+
+class _Sampler(threading.Thread):
+    """Samples one thread's stack below _run(), tagged with the current stage."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="kling-profile", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.trace = None  # Trace of the run in progress; None between runs
+        self.samples = {}
+        self._done = threading.Event()
+
+    def run(self):
+        frames, root = sys._current_frames, _run.__code__
+        while not self._done.wait(self.interval):
+            trace, frame = self.trace, frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not root:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if trace is None or frame is None:
+                continue  # between runs
+            key = (f"stage:{trace.current or 'other'}", *reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class ProfileResult:
+    def __init__(self, prompt, stats, samples, trace, runs, interval):
+        self.prompt = prompt
+        self.stats = stats  # pstats.Stats of the cProfile pass
+        self.samples = samples  # {(stage, frame, ...): count} from the sampling pass
+        self.trace = trace  # stage timings of the last sampled run
+        self.runs = runs
+        self.interval = interval
+
+    def pstats_bytes(self):
+        """The cProfile pass in pstats' file format (as written by dump_stats())."""
+        return marshal.dumps(self.stats.stats)
+
+    def collapsed(self):
+        """Sampled stacks, one `frame;frame;... count` line each, stage first."""
+        return "".join(f"{';'.join(stack)} {n}\n" for stack, n in sorted(self.samples.items()))
+
+    def by_stage(self):
+        """{stage: share of samples}, largest first."""
+        counts = {}
+        for stack, n in self.samples.items():
+            stage = stack[0][len("stage:"):]
+            counts[stage] = counts.get(stage, 0) + n
+        total = sum(counts.values()) or 1
+        return {stage: n / total for stage, n in sorted(counts.items(), key=lambda kv: -kv[1])}
+
+    def summary(self, limit=20):
+        lines = [f"{self.runs} sampled runs, {sum(self.samples.values())} samples every {self.interval * 1e3:g} ms",
+                 f"last run: {self.trace.total_ms:.2f} ms"]
+        lines += [f"  {s['stage']:<14} {s['ms']:9.3f} ms" for s in self.trace.stages if "ms" in s]
+        lines.append("samples by stage:")
+        lines += [f"  {stage:<14} {share:6.1%}" for stage, share in self.by_stage().items()]
+        out = io.StringIO()
+        pstats.Stats(stream=out).add(self.stats).sort_stats("cumulative").print_stats(limit)
+        return "\n".join(lines) + "\n\n" + out.getvalue().strip() + "\n"
+
+
+def profile_prompt(text, duration=1.0, interval=0.001, cold=True, fast_switch=True, **options):
+    """Profile perfect_prompt(text, **options); returns a ProfileResult."""
+    text = text or ""
+    options.pop("cache", None)
+    options.pop("trace", None)
+    with _LOCK:
+        profiler = cProfile.Profile()
+        prompt = profiler.runcall(_run, text, options, Trace(), cold)
+        stats = pstats.Stats(profiler)
+
+        sampler = _Sampler(threading.get_ident(), interval)
+        switch = sys.getswitchinterval()
+        if fast_switch:
+            sys.setswitchinterval(min(switch, interval / 2))  # let the sampler take the GIL on time
+        sampler.start()
+        runs, end = 0, time.perf_counter() + duration
+        try:
+            while not runs or time.perf_counter() < end:
+                trace = Trace()
+                sampler.trace = trace
+                _run(text, options, trace, cold)
+                sampler.trace = None
+                runs += 1
+        finally:
+            sampler.stop()
+            sys.setswitchinterval(switch)
+    return ProfileResult(prompt, stats, sampler.samples, trace, runs, interval)
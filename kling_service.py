@@ -0,0 +1,218 @@
+"""Asyncio HTTP service for the Kling Prompt Perfecter (standard library only).
+
+    python kling_service.py --port 8080 --workers 4
+    curl -s localhost:8080/perfect -d '{"text": "A knight at dawn", "pack": "Medieval High Fantasy"}'
+    curl -s localhost:8080/perfect -d '{"scenes": [{"text": "..."}, {"text": "..."}], "brevity": "concise"}'
+
+POST /perfect takes either one scene ({"text": ..., options}) or a batch
+({"scenes": [...], default options}); options are the batch row fields.
+Extraction runs in an executor. Identical requests already in flight share
+one job, and once `max_queue` distinct jobs are pending new work gets 503
+with Retry-After instead of queueing without bound; a batch that could
+never fit (more distinct scenes than `max_queue`) gets 413.
+Options are validated before anything is queued: a single scene with an
+invalid option (unknown pack, style or brevity, wrong type) gets 400; in a
+batch the failure is reported in that scene's result and the other scenes
+still run.
+GET /healthz and GET /stats are for probes and monitoring.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from kling_batch import OPTION_FIELDS, TEXT_FIELDS, perfect_row, row_options
+
+MAX_BODY = 4 << 20
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class TooManyScenes(Exception):
+    pass
+
+
+class PerfecterService:
+    def __init__(self, workers=None, max_queue=256, threads=False, max_body=MAX_BODY):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_body = max_body
+        if threads:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            # Forked workers would inherit open client sockets and hold connections open
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        self._inflight = {}
+        self.stats = {"requests": 0, "scenes": 0, "jobs": 0, "coalesced": 0, "rejected": 0}
+
+    @staticmethod
+    def _key(row):
+        raw = json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _reserve(self, rows):
+        # Count distinct new jobs up front so a batch is accepted or rejected whole
+        new = {self._key(r) for r in rows} - self._inflight.keys()
+        if len(new) > self.max_queue:
+            raise TooManyScenes(f"batch has {len(new)} distinct scenes; at most {self.max_queue} are accepted at once")
+        if len(self._inflight) + len(new) > self.max_queue:
+            self.stats["rejected"] += 1
+            raise Overloaded(f"queue full ({len(self._inflight)} pending)")
+
+    def _submit(self, row):
+        key = self._key(row)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.stats["coalesced"] += 1
+            return fut
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._pool, perfect_row, row)
+        self._inflight[key] = fut
+        fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self.stats["jobs"] += 1
+        return fut
+
+    async def perfect(self, rows):
+        self._reserve(rows)
+        self.stats["scenes"] += len(rows)
+        # shield: a client disconnecting must not cancel a job others share
+        return await asyncio.gather(*(asyncio.shield(self._submit(r)) for r in rows))
+
+    @staticmethod
+    def _rows(payload):
+        if not isinstance(payload, dict):
+            raise ValueError("expected a JSON object")
+        if "scenes" not in payload:
+            return [payload], False
+        scenes = payload["scenes"]
+        if not isinstance(scenes, list):
+            raise ValueError("'scenes' must be a list")
+        defaults = {k: payload[k] for k in OPTION_FIELDS if k in payload}
+        rows = []
+        for scene in scenes:
+            if not isinstance(scene, (dict, str)):
+                raise ValueError("each scene must be an object or a string")
+            row = dict(defaults)
+            row.update(scene if isinstance(scene, dict) else {"text": scene})
+            rows.append(row)
+        return rows, True
+
+    @staticmethod
+    def _check(row):
+        """Validate one scene before it takes a queue slot; ValueError if it can't be perfected."""
+        if not any(row.get(k) for k in TEXT_FIELDS):
+            raise ValueError("each scene needs a 'text' field")
+        row_options(row)
+
+    async def dispatch(self, method, path, body):
+        path = path.split("?", 1)[0]
+        if path == "/healthz":
+            return 200, {"status": "ok"}, {}
+        if path == "/stats":
+            return 200, dict(self.stats, pending=len(self._inflight), max_queue=self.max_queue), {}
+        if path != "/perfect":
+            return 404, {"error": "not found"}, {}
+        if method != "POST":
+            return 405, {"error": "use POST"}, {"Allow": "POST"}
+        self.stats["requests"] += 1
+        try:
+            rows, batched = self._rows(json.loads(body or b"{}"))
+        except ValueError as e:
+            return 400, {"error": str(e)}, {}
+        errors = {}
+        for i, row in enumerate(rows):
+            try:
+                self._check(row)
+            except ValueError as e:
+                errors[i] = dict({"id": row["id"]} if "id" in row else {}, error=str(e))
+        if errors and not batched:
+            return 400, errors[0], {}
+        try:
+            done = iter(await self.perfect([row for i, row in enumerate(rows) if i not in errors]))
+        except TooManyScenes as e:
+            return 413, {"error": str(e)}, {}
+        except Overloaded as e:
+            return 503, {"error": str(e)}, {"Retry-After": "1"}
+        except Exception as e:  # e.g. a broken worker pool; keep serving other requests
+            return 500, {"error": f"{type(e).__name__}: {e}"}, {}
+        results = [errors[i] if i in errors else next(done) for i in range(len(rows))]
+        if batched:
+            return 200, {"results": results}, {}  # per-scene errors are reported in their result
+        return (400 if "error" in results[0] else 200), results[0], {}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > self.max_body:
+                    await self._respond(writer, 413, {"error": "body too large"}, {}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload, extra = await self.dispatch(method, target, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, extra, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json; charset=utf-8",
+                f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        head += [f"{k}: {v}" for k, v in extra.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="kling_service", description="HTTP service for the Kling Prompt Perfecter.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--workers", type=int, help="extraction workers (default: CPU count)")
+    p.add_argument("--max-queue", type=int, default=256, help="max distinct pending jobs before answering 503")
+    p.add_argument("--threads", action="store_true", help="use a thread pool instead of processes (local testing)")
+    args = p.parse_args(argv)
+
+    service = PerfecterService(workers=args.workers, max_queue=args.max_queue, threads=args.threads)
+    print(f"Kling Prompt Perfecter service on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
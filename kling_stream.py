@@ -0,0 +1,187 @@
+"""Streaming extraction for long scripts: one Kling prompt per scene.
+
+Input is read chunk by chunk and split into scenes on screenplay headings
+(INT./EXT. ...) or blank-line blocks. Each scene's text is fed through a
+TermStream/NameStream as it arrives and never held whole, so memory stays
+bounded by the chunk size and the vocabulary, not by the script.
+"""
+import re
+
+from kling_core import DEFAULT_PACK, DEFAULT_STYLE, NameTally, get_vocabulary, render_prompt
+
+CHUNK_SIZE = 64 * 1024
+LINE_PIECE = 4096  # longer lines are fed in pieces once classified
+SCENE_HEADING = re.compile(r"\s*(?:(?:INT\.?/EXT|INT|EXT|EST|I/E)[.\s]|SCENE\s+\d)")
+
+
+class TermStream:
+    """Feeds text to a TermMatcher in chunks.
+
+    Keeps an overlap of the longest term (plus one character of left
+    context) between chunks, so multi-word terms that straddle a chunk
+    boundary still match exactly as they would in the whole text.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.hits = {}  # id -> [count, first offset], as TermMatcher.tally()
+        self.length = 0
+        self._buf = ""
+        self._pos = 0
+        self._offset = 0  # position of _buf[0] in the whole text
+
+    def _merge(self, stats):
+        hits = self.hits
+        for tid, (count, first) in stats.items():
+            s = hits.get(tid)
+            if s is None:
+                hits[tid] = [count, first]
+            else:
+                s[0] += count
+
+    def feed(self, chunk):
+        buf = self._buf + chunk.lower()
+        self.length += len(buf) - len(self._buf)
+        stop = len(buf) - self.matcher.longest
+        if stop > self._pos:
+            self._merge(self.matcher.tally(buf, self._pos, stop, self._offset))
+            cut = stop - 1 if stop > 0 else 0
+            self._buf, self._pos, self._offset = buf[cut:], stop - cut, self._offset + cut
+        else:
+            self._buf = buf
+
+    def close(self):
+        self._merge(self.matcher.tally(self._buf, self._pos, offset=self._offset))
+        self._buf, self._pos = "", 0
+        return self.hits
+
+
+class NameStream:
+    """Chunked proper_names(): tokens never span whitespace, so each chunk is
+    cut after its last whitespace and the remainder carried over."""
+
+    MAX_CARRY = 4096
+
+    def __init__(self, exclude=()):
+        self._tally = NameTally(exclude)
+        self._carry = ""
+
+    def feed(self, chunk):
+        text = self._carry + chunk
+        cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+        if cut < 0 and len(text) <= self.MAX_CARRY:
+            self._carry = text
+            return
+        cut = cut + 1 if cut >= 0 else len(text)
+        self._tally.feed(text[:cut])
+        self._carry = text[cut:]
+
+    def close(self):
+        self._tally.feed(self._carry)
+        self._carry = ""
+        return self._tally.ranked()
+
+
+class SceneExtraction:
+    def __init__(self, vocab, index, heading=None):
+        self.index = index
+        self.heading = heading
+        self.chars = 0
+        self._terms = TermStream(vocab.matcher)
+        self._names = NameStream(vocab.matcher)
+
+    def feed(self, text, names=True):
+        self.chars += len(text)
+        self._terms.feed(text)
+        if names:
+            self._names.feed(text)
+
+    def result(self):
+        hits = self._terms.close()
+        return {"names": self._names.close(), "terms": self._terms.matcher.route(hits, self._terms.length)}
+
+
+def iter_chunks(source, size=CHUNK_SIZE):
+    if isinstance(source, str):
+        for i in range(0, len(source), size):
+            yield source[i:i + size]
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from source
+
+
+def _lines(chunks, max_len):
+    """Yield (piece, complete) per line; lines longer than max_len come out
+    in several pieces with complete=False on all but the last."""
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        start = 0
+        while True:
+            nl = buf.find("\n", start)
+            if nl < 0:
+                break
+            yield buf[start:nl], True
+            start = nl + 1
+        buf = buf[start:]
+        if len(buf) > max_len:
+            yield buf, False
+            buf = ""
+    if buf:
+        yield buf, True
+
+
+def iter_scenes(source, vocab, split="auto", chunk_size=CHUNK_SIZE):
+    """Yield (SceneExtraction, extraction dict) per scene.
+
+    split="heading" starts a scene at each screenplay heading, "blank" at
+    each blank-line block, and "auto" splits on blank lines until the first
+    heading appears, then on headings only (screenplays use blank lines
+    inside scenes).
+    """
+    by_heading = split == "heading"
+    scene = None
+    count = 0
+    cont = False  # piece continues a long line already fed as content
+
+    for piece, complete in _lines(iter_chunks(source, chunk_size), max(chunk_size, LINE_PIECE)):
+        tail = "\n" if complete else ""
+        if cont:
+            scene.feed(piece + tail)
+            cont = not complete
+            continue
+        if not piece.strip():
+            if not by_heading and scene is not None and scene.chars:
+                yield scene, scene.result()
+                scene = None
+            continue
+        if split != "blank" and SCENE_HEADING.match(piece):
+            by_heading = by_heading or split == "auto"
+            if scene is not None and scene.chars:
+                yield scene, scene.result()
+            count += 1
+            scene = SceneExtraction(vocab, count, piece.strip())
+            scene.feed(piece + tail, names=False)
+        else:
+            if scene is None:
+                count += 1
+                scene = SceneExtraction(vocab, count)
+            scene.feed(piece + tail)
+        cont = not complete
+    if scene is not None and scene.chars:
+        yield scene, scene.result()
+
+
+def stream_prompts(source, pack=DEFAULT_PACK, style=DEFAULT_STYLE, brevity="standard", labels=True,
+                   max_items=10, char_name="", char_sheet="", negative="", custom_pack=None,
+                   fmt="text", budget=0, split="auto", chunk_size=CHUNK_SIZE):
+    """Yield (scene, prompt) for each scene of a file, string or chunk iterator."""
+    vocab = get_vocabulary(pack, custom_pack)
+    for scene, extraction in iter_scenes(source, vocab, split=split, chunk_size=chunk_size):
+        yield scene, render_prompt(extraction, style, brevity, labels, max_items, char_name, char_sheet, negative,
+                                   fmt, budget)
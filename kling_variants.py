@@ -0,0 +1,132 @@
+"""Spelling variants of vocabulary terms, indexed alongside the exact terms.
+
+variant_index() maps alternative spellings to the canonical term they
+should count as: plural/singular forms of the last word of noun terms
+("lanterns", "cloak" for "cloaks"; never for plural-only nouns such as
+"pants" or "woods", nor plurals that double as verbs: "watches",
+"books"), hyphen/space/joined forms ("close up", "closeup" for
+"close-up") and, optionally, common typos at edit distance 1 (a
+dropped, doubled or swapped letter) for words of five letters or more.
+TermMatcher puts these strings into the same trie as the exact terms,
+so matching a variant costs nothing extra at scan time.
+
+A variant that is itself a vocabulary term, or that two different terms
+would both produce at the same level, is left out: exact spellings and
+unambiguous variants only.
+"""
+
+IRREGULAR_PLURALS = {
+    "man": "men", "woman": "women", "child": "children", "person": "people", "foot": "feet",
+    "tooth": "teeth", "goose": "geese", "mouse": "mice", "knife": "knives", "wolf": "wolves",
+    "leaf": "leaves", "thief": "thieves", "elf": "elves", "dwarf": "dwarves", "shelf": "shelves",
+}
+_SINGULARS = {v: k for k, v in IRREGULAR_PLURALS.items()}
+# Nouns that only exist in the plural, or whose singular means something else
+PLURAL_ONLY = frozenset("""
+pants trousers shorts jeans leggings tights goggles glasses spectacles binoculars scissors pliers tongs clothes
+woods ruins remains stairs outskirts surroundings ashes riches arms quarters gallows barracks headquarters
+""".split())
+# Nouns whose plural is also a common verb form ("Mira watches", "Vance books a
+# ship"); as single-word terms they match only as written
+VERB_NOUNS = frozenset("""
+book chain clock cloak coat deck drone drum dust feather field forge glitter guard gun hammer harbor lasso machine
+map mask master mentor mist park pilot port ring robe saddle scroll shield ship smoke spear staff steam tool tower
+veil watch wrench
+""".split())
+_VOWELS = frozenset("aeiou")
+TYPO_MIN_LENGTH = 5
+
+
+def _plural(word):
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word.endswith(("s", "x", "z", "ch", "sh")):
+        return word + "es"
+    if word.endswith("y") and len(word) > 1 and word[-2] not in _VOWELS:
+        return word[:-1] + "ies"
+    return word + "s"
+
+
+def _singular(word):
+    if word in _SINGULARS:
+        return _SINGULARS[word]
+    if word in PLURAL_ONLY or len(word) < 4 or not word.endswith("s") or word.endswith(("ss", "us", "is", "as", "ys")):
+        return None
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    return word[:-1]
+
+
+def number_variants(term):
+    """The term with its last word pluralized or singularized."""
+    head, sep, last = term.rpartition(" ")
+    if not last.isalpha():
+        return []
+    out = [] if not head and last in VERB_NOUNS else [head + sep + _plural(last)]
+    singular = _singular(last)
+    if singular:
+        out.append(head + sep + singular)
+    return out
+
+
+def separator_variants(term):
+    """'close-up' -> 'close up', 'closeup'; 'trench coat' -> 'trench-coat'."""
+    out = []
+    if "-" in term:
+        out += [term.replace("-", " "), term.replace("-", "")]
+    if " " in term:
+        out.append(term.replace(" ", "-"))
+    return out
+
+
+def typo_variants(term):
+    """Edit-distance-1 typos of a single word: one letter dropped, doubled or swapped.
+
+    The first letter is never touched; dropping it mostly yields real words
+    ("sword" -> "word").
+    """
+    if len(term) < TYPO_MIN_LENGTH or not term.isalpha():
+        return set()
+    out = set()
+    for i in range(1, len(term)):
+        out.add(term[:i] + term[i + 1:])
+        out.add(term[:i] + term[i] + term[i:])
+        if i + 1 < len(term) and term[i] != term[i + 1]:
+            out.add(term[:i] + term[i + 1] + term[i] + term[i + 2:])
+    out.discard(term)
+    return out
+
+
+def _forms(term, nouns):
+    out = separator_variants(term)
+    if nouns is None or term in nouns:
+        out += number_variants(term) + [v for s in separator_variants(term) for v in number_variants(s)]
+    return out
+
+
+def variant_index(terms, typos=False, nouns=None):
+    """{variant: canonical term} for an iterable of lowercase terms.
+
+    Only terms in `nouns` (all terms when None) get plural/singular forms:
+    pluralizing adjectives and verbs ("short", "lit") matches unrelated words.
+    """
+    terms = set(terms)
+    nouns = None if nouns is None else set(nouns)
+    index = {}
+    levels = [lambda t: _forms(t, nouns)]
+    if typos:
+        levels.append(typo_variants)
+    for make in levels:
+        found, ambiguous = {}, set()
+        for term in terms:
+            for variant in make(term):
+                if variant in terms or variant in index or not variant.strip():
+                    continue
+                if found.setdefault(variant, term) != term:
+                    ambiguous.add(variant)
+        for variant in ambiguous:
+            del found[variant]
+        index.update(found)
+    return index